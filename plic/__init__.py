@@ -7,3 +7,9 @@ __version__ = metadata.version
 __author__ = metadata.authors[0]
 __license__ = metadata.license
 __copyright__ = metadata.copyright
+
+
+def inspect(path):
+    """Describe the compressed image at `path` without decoding it, see :func:`plic.container.inspect`."""
+    from plic import container
+    return container.inspect(path)
@@ -2,19 +2,20 @@
 """Program entry point"""
 
 import argparse
+import json
+import os
 import sys
 from os.path import basename
 import logging
-import pickle
-import zlib
 
-from scipy import misc
-from plic import __metadata__ as metadata, colorspace, compression
+from plic import __metadata__ as metadata, bench, cache, codebook, compression, container, imagefile, pack, server
 
+_LOG = logging.getLogger(__name__)
 
-def _make_parser(prog_name):
+
+def _epilog():
     author_strings = ['Author: {0} <{1}>'.format(name, email) for name, email in zip(metadata.authors, metadata.emails)]
-    epilog = '''
+    return '''
 {project} {version}
 
 {authors}
@@ -22,11 +23,13 @@ def _make_parser(prog_name):
            version=metadata.version,
            authors='\n'.join(author_strings))
 
+
+def _make_base_parser(prog_name, description):
     parser = argparse.ArgumentParser(
         prog=prog_name,
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        description=metadata.description,
-        epilog=epilog
+        description=description,
+        epilog=_epilog()
     )
     parser.add_argument(
         '--version',
@@ -38,16 +41,49 @@ def _make_parser(prog_name):
         action='store_true',
         default=False,
     )
+    return parser
+
+
+def _make_parser(prog_name):
+    parser = _make_base_parser(prog_name, metadata.description)
     parser.add_argument(
         "-o", "--output",
         type=argparse.FileType('wb'),
-        help="The name of the output file.",
+        help="The name of the output file. Decompressed .npy, .ppm and .raw files are written "
+        "directly, other formats are written with PIL.",
     )
     parser.add_argument(
         "-t", "--interpratio",
+        type=compression.parse_ratio,
+        help="Interpolation ratio, as R or RYxRX, a comma separated list of the ratios of each level, or auto.",
+    )
+    parser.add_argument(
+        "--shape",
+        type=imagefile.parse_shape,
+        help="The shape of a .raw input image, as HEIGHTxWIDTH or HEIGHTxWIDTHxCHANNELS.",
+    )
+    parser.add_argument(
+        "-l", "--level",
         type=int,
-        default=2,
-        help="Interpolation ratio.",
+        choices=range(len(compression.CompressionConfig.PRESETS)),
+        default=compression.CompressionConfig.DEFAULT_LEVEL,
+        help="Compression level, from 0 for the fastest to 9 for the best compression ratio.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="A directory to cache compressed images in, so that images compressed before with the same "
+        "settings are not compressed again.",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="The number of seconds compressing should take at most. Cheaper settings are used for the "
+        "levels that would not be done in time otherwise.",
+    )
+    parser.add_argument(
+        "--codebook",
+        help="A shared codebook trained by `plic train`. Compressed images will be encoded with it, "
+        "and it will be available when decompressing.",
     )
     operation_mode = parser.add_mutually_exclusive_group(required=False)
     operation_mode.add_argument(
@@ -58,6 +94,10 @@ def _make_parser(prog_name):
         "-d", "--decompress", action='store_true',
         help="The input file should be compressed.",
     )
+    operation_mode.add_argument(
+        "-e", "--estimate", action='store_true',
+        help="Estimate the compressed size of the input file without compressing it.",
+    )
     parser.add_argument(
         "input",
         help="The input file to be processed. If both compress and decompress "
@@ -68,6 +108,212 @@ def _make_parser(prog_name):
     return parser
 
 
+def _make_pack_parser(prog_name):
+    parser = _make_base_parser(prog_name, "Compress many images into a single pack, named by their file names.")
+    parser.add_argument(
+        "-o", "--output",
+        required=True,
+        help="The name of the pack.",
+    )
+    parser.add_argument(
+        "-l", "--level",
+        type=int,
+        choices=range(len(compression.CompressionConfig.PRESETS)),
+        default=compression.CompressionConfig.DEFAULT_LEVEL,
+        help="Compression level, from 0 for the fastest to 9 for the best compression ratio.",
+    )
+    parser.add_argument(
+        "-t", "--interpratio",
+        type=compression.parse_ratio,
+        help="Interpolation ratio, as R or RYxRX, a comma separated list of the ratios of each level, or auto.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="A directory to cache compressed images in, so that images compressed before with the same "
+        "settings are not compressed again.",
+    )
+    parser.add_argument(
+        "input",
+        nargs='+',
+        help="The images to be compressed. Files that are already compressed are added as they are.",
+    )
+    return parser
+
+
+def _disk_cache(args):
+    """Get the :class:`plic.cache.DiskCache` in the ``--cache-dir`` of the arguments, or None if none is given."""
+    return cache.DiskCache(args.cache_dir) if args.cache_dir else None
+
+
+def _compress(image, config, disk_cache):
+    """Compress an image to container bytes, through `disk_cache` if it isn't None."""
+    if disk_cache is not None:
+        return disk_cache.compress(image, config)
+    return container.dumps(compression.compress(image, config))
+
+
+def _pack(args):
+    config = _config(args)
+    # One cache for all the images, so that it keeps the running total of its size
+    disk_cache = _disk_cache(args)
+    with pack.PackWriter(args.output) as writer:
+        for path in args.input:
+            if path.endswith('.plic'):
+                with open(path, 'rb') as f:
+                    writer.add(basename(path), f.read())
+            else:
+                writer.add(basename(path), _compress(imagefile.read(path), config, disk_cache))
+
+
+def _make_serve_parser(prog_name):
+    parser = _make_base_parser(prog_name, "Serve the decoded images in a directory over HTTP.")
+    parser.add_argument(
+        "--host",
+        default='localhost',
+        help="The address to listen on.",
+    )
+    parser.add_argument(
+        "-p", "--port",
+        type=int,
+        default=8000,
+        help="The port to listen on.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        help="The size of the decoded image cache, in megabytes.",
+    )
+    parser.add_argument(
+        "directory",
+        help="The directory containing the compressed images.",
+    )
+    return parser
+
+
+def _make_bench_parser(prog_name):
+    parser = _make_base_parser(prog_name, "Compare the compression levels of plic with other lossless codecs.")
+    parser.add_argument(
+        "-f", "--format",
+        choices=('csv', 'json'),
+        default='csv',
+        help="The format of the results.",
+    )
+    parser.add_argument(
+        "-c", "--codec",
+        action='append',
+        help="A codec to compare, such as plic-5, png, webp, zlib or lzma. May be given many times, all are "
+             "compared by default.",
+    )
+    parser.add_argument(
+        "directory",
+        nargs='?',
+        help="The directory containing the RGB images to compare the codecs on. The test images of scikit-image are "
+             "used by default.",
+    )
+    return parser
+
+
+def _bench(args):
+    if args.directory:
+        paths = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory))
+        images = ((basename(path), imagefile.read(path)) for path in paths if os.path.isfile(path))
+    else:
+        images = bench.test_images()
+    results = bench.run(images, args.codec)
+    results += bench.aggregate(results)
+    if args.format == 'json':
+        for result in results:
+            print(json.dumps(result, sort_keys=True))
+    else:
+        bench.write_csv(results, sys.stdout)
+
+
+def _make_info_parser(prog_name):
+    parser = _make_base_parser(prog_name, "Describe compressed images as JSON, reading only their headers.")
+    parser.add_argument(
+        "input",
+        nargs='+',
+        help="The compressed images. Each is described on its own line.",
+    )
+    return parser
+
+
+def _info(args):
+    for path in args.input:
+        info = container.inspect(path)
+        info['path'] = path
+        print(json.dumps(info, sort_keys=True))
+
+
+def _make_train_parser(prog_name):
+    parser = _make_base_parser(prog_name, "Train a shared codebook from a sample of images.")
+    parser.add_argument(
+        "-o", "--output",
+        default='.',
+        help="The directory to save the codebook in. The codebook is named after its ID.",
+    )
+    parser.add_argument(
+        "-l", "--level",
+        type=int,
+        choices=range(len(compression.CompressionConfig.PRESETS)),
+        default=compression.CompressionConfig.DEFAULT_LEVEL,
+        help="The compression level the images will be compressed with.",
+    )
+    parser.add_argument(
+        "-t", "--interpratio",
+        type=compression.parse_ratio,
+        help="Interpolation ratio, as R or RYxRX, a comma separated list of the ratios of each level, or auto.",
+    )
+    parser.add_argument(
+        "input",
+        nargs='+',
+        help="The sample images.",
+    )
+    return parser
+
+
+def _config(args):
+    """Get the compression settings given in the command-line arguments."""
+    settings = {}
+    if args.interpratio is not None:
+        settings['ratio'] = args.interpratio
+    if getattr(args, 'time_budget', None) is not None:
+        settings['time_budget'] = args.time_budget
+    if getattr(args, 'codebook', None):
+        settings['codebook'] = 'shared'
+        settings['shared_codebook'] = codebook.load(args.codebook)
+    return compression.CompressionConfig.preset(args.level, **settings)
+
+
+def _train(args):
+    trained = codebook.train((imagefile.read(path) for path in args.input), _config(args))
+    path = codebook.save(trained, args.output)
+    print(trained.id)
+    _LOG.info("Saved codebook %s to %s", trained.id, path)
+
+
+def _serve(args):
+    decoder = server.Decoder(args.directory, args.cache_size * 2 ** 20)
+    httpd = server.Server((args.host, args.port), decoder)
+    _LOG.info("Serving %s on %s:%s", args.directory, *httpd.server_address[:2])
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+_COMMANDS = {
+    'bench': (_make_bench_parser, _bench),
+    'info': (_make_info_parser, _info),
+    'pack': (_make_pack_parser, _pack),
+    'serve': (_make_serve_parser, _serve),
+    'train': (_make_train_parser, _train),
+}
+
+
 def _setup_logger(level):
     """Sets up the root logger.
 
@@ -96,20 +342,37 @@ def main(argv):
 
     :raises SystemExit: Raised to exit the program if there were no errors.
     """
+    if len(argv) > 1 and argv[1] in _COMMANDS:
+        make_parser, command = _COMMANDS[argv[1]]
+        parser = make_parser(prog_name='{0} {1}'.format(basename(argv[0]), argv[1]))
+        args = parser.parse_args(argv[2:])
+        _setup_logger(logging.INFO if args.verbose else logging.WARNING)
+        command(args)
+        raise SystemExit(0)
     parser = _make_parser(prog_name=basename(argv[0]))
     args = parser.parse_args(argv[1:])
     _setup_logger(logging.INFO if args.verbose else logging.WARNING)
+    config = _config(args)
     if args.compress:
-        image = misc.imread(args.input)
-        transformed = colorspace.rgb2rdgdb(image)
-        compressed = compression.CompressedImage(transformed, ratio=args.interpratio)
-        encoded = zlib.compress(pickle.dumps(compressed))
-        args.output.write(encoded)
+        image = imagefile.read(args.input, args.shape)
+        args.output.write(_compress(image, config, _disk_cache(args)))
     elif args.decompress:
-        decoded = pickle.loads(zlib.decompress(args.input.read()))
-        decompressed = decoded.reconstruct()
-        detransformed = colorspace.rdgdb2rgb(decompressed)
-        misc.imsave(args.output, detransformed)
+        compressed = container.load(args.input)
+        if imagefile.file_format(args.output.name):
+            # Decode straight into the mapped output file
+            args.output.close()
+            out = imagefile.create(args.output.name, compressed.shape)
+            compression.decompress(compressed, out=out)
+            out.flush()
+        else:
+            imagefile.write(args.output, compression.decompress(compressed))
+    elif args.estimate:
+        image = imagefile.read(args.input, args.shape)
+        sizes = compression.estimate_size(image, config)
+        for level, size in enumerate(sizes):
+            print("Level {0}: {1} bytes".format(level, size))
+        m, n = image.shape[:2]
+        print("Total: {0} bytes, {1:.3f} bits per pixel".format(sum(sizes), sum(sizes) * 8 / (m * n)))
     raise SystemExit(0)
 
 
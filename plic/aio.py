@@ -0,0 +1,99 @@
+"""Asyncio interface for compressing and decompressing images.
+
+The work is done in a pool of processes, so that the event loop is not
+blocked. The number of requests that may be waiting for the pool is
+bounded, and any further requests wait until there is room for them.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import weakref
+
+from scipy import misc
+from plic import compression, container
+
+
+# Python 3.5 and 3.6 have no get_running_loop, but get_event_loop gives the running loop in a coroutine
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def _compress(data, config):
+    image = misc.imread(io.BytesIO(data))
+    return container.dumps(compression.compress(image, config))
+
+
+def _decompress(data, level):
+    return compression.decompress(container.loads(data), level)
+
+
+class Service:
+    def __init__(self, max_workers=None, max_pending=None):
+        """Start a pool of `max_workers` processes to compress and decompress images.
+
+        At most `max_pending` requests from each event loop are
+        submitted to the pool at any time, including the ones that are
+        being processed. By default, this is twice the number of
+        workers.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(max_workers)
+        self._max_pending = max_pending or 2 * max_workers
+        # The semaphores that bound the pending requests, by event loop, as a semaphore only works in its own loop
+        self._pending = weakref.WeakKeyDictionary()
+
+    def _semaphore(self, loop):
+        """Get the semaphore that bounds the pending requests from `loop`, which must be running."""
+        semaphore = self._pending.get(loop)
+        if semaphore is None:
+            semaphore = self._pending[loop] = asyncio.Semaphore(self._max_pending)
+        return semaphore
+
+    async def _submit(self, function, *args):
+        """Run `function` in the pool once there is room for it.
+
+        If the request is cancelled before a worker picks it up, it is
+        removed from the pool without being processed.
+        """
+        loop = _running_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self._executor, function, *args)
+
+    async def compress(self, data, config=None):
+        """Compress the image file in `data` with `config`, and return the container bytes."""
+        return await self._submit(_compress, bytes(data), config)
+
+    async def decompress(self, data, level=None):
+        """Decompress the container bytes in `data` up to `level`, and return the RGB image."""
+        return await self._submit(_decompress, bytes(data), level)
+
+    def close(self):
+        """Shut down the process pool."""
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+_SERVICE = None
+
+
+def _default_service():
+    global _SERVICE
+    if _SERVICE is None:
+        _SERVICE = Service()
+    return _SERVICE
+
+
+async def compress(data, config=None):
+    """Compress the image file in `data` using the shared service."""
+    return await _default_service().compress(data, config)
+
+
+async def decompress(data, level=None):
+    """Decompress the container bytes in `data` using the shared service."""
+    return await _default_service().decompress(data, level)
@@ -0,0 +1,200 @@
+"""Comparison of plic with other lossless codecs.
+
+Each image is encoded and decoded with each codec, checking that the
+decoded image is the same as the original. The results have the size
+in bits per pixel, the encoding and decoding speed in megabytes of
+pixels per second, and the peak memory that encoding and decoding
+took. For plic, the time spent predicting and entropy coding the
+levels of the pyramid is given too.
+
+Each codec is run in a new process where the system allows it, so that
+its peak memory use can be measured apart from the other codecs.
+"""
+
+import csv
+import io
+import lzma
+import multiprocessing
+import time
+import zlib
+
+import numpy as np
+from PIL import Image
+from plic import compression, container
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The columns of the results
+FIELDS = ('image', 'codec', 'pixels', 'bytes', 'bpp', 'encode_mbps', 'decode_mbps', 'peak_memory_mb',
+          'predict_seconds', 'entropy_seconds')
+
+
+def _plic(level):
+    config = compression.CompressionConfig.preset(level)
+
+    def encode(image):
+        compressed = compression.compress(image, config)
+        stages = {'predict_seconds': 0, 'entropy_seconds': 0}
+        for i in range(compressed.depth - 1):
+            timings = compressed.level(i).timings
+            stages['predict_seconds'] += timings['predict']
+            stages['entropy_seconds'] += timings['encode']
+        return container.dumps(compressed), stages
+
+    def decode(data, shape):
+        return compression.decompress(container.loads(data))
+    return encode, decode
+
+
+def _pillow(image_format, **options):
+    def encode(image):
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format=image_format, **options)
+        return buffer.getvalue(), {}
+
+    def decode(data, shape):
+        return np.asarray(Image.open(io.BytesIO(data)))
+    return encode, decode
+
+
+def _bytes(compress, decompress):
+    def encode(image):
+        return compress(np.ascontiguousarray(image).tobytes()), {}
+
+    def decode(data, shape):
+        return np.frombuffer(decompress(data), dtype=np.uint8).reshape(shape)
+    return encode, decode
+
+
+def codecs():
+    """Get the codecs that can be compared, by name, as functions that encode and decode images."""
+    available = {'plic-{0}'.format(level): _plic(level) for level in range(len(compression.CompressionConfig.PRESETS))}
+    available['png'] = _pillow('PNG')
+    available['zlib'] = _bytes(lambda data: zlib.compress(data, 9), zlib.decompress)
+    available['lzma'] = _bytes(lzma.compress, lzma.decompress)
+    # Pillow may be built without WebP
+    webp = _pillow('WEBP', lossless=True)
+    try:
+        webp[0](np.zeros((1, 1, 3), dtype=np.uint8))
+    except (IOError, KeyError, ValueError):
+        pass
+    else:
+        available['webp'] = webp
+    return available
+
+
+def _megabytes(pixels):
+    """The size of `pixels` RGB pixels in megabytes, which the speeds are given in."""
+    return pixels * 3 / 2 ** 20
+
+
+def _peak_rss():
+    """Get the peak resident memory of the process in megabytes."""
+    # Linux gives the size in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(name, image):
+    """Encode and decode `image` with the codec called `name`, and check that it is decoded losslessly.
+
+    Returns the size of the encoded image, the seconds encoding and
+    decoding took, the peak memory they took above what the process
+    used before, if it can be measured, and the time of each stage.
+    """
+    encode, decode = codecs()[name]
+    before = _peak_rss() if resource else None
+    start = time.perf_counter()
+    data, stages = encode(image)
+    encoded = time.perf_counter()
+    decoded = decode(data, image.shape)
+    finished = time.perf_counter()
+    peak = _peak_rss() - before if resource else None
+    if decoded.shape != image.shape or not (decoded == image).all():
+        raise AssertionError("{0} did not decode losslessly".format(name))
+    return len(data), encoded - start, finished - encoded, peak, stages
+
+
+def _isolated(name, image):
+    """Run :func:`_measure` in a new process, where the peak memory is not raised by anything else that ran before."""
+    if resource is None:
+        return _measure(name, image)
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        return pool.apply(_measure, (name, image))
+
+
+def run(images, names=None):
+    """Compare the codecs called `names`, or all of them, on the named RGB images in `images`.
+
+    `images` is an iterable of ``(name, image)`` pairs. Returns the
+    results of each image and codec as dicts with the keys in
+    :data:`FIELDS`.
+    """
+    available = codecs()
+    names = names or sorted(available)
+    unknown = set(names) - set(available)
+    if unknown:
+        raise ValueError("Unknown codecs: {0}".format(', '.join(sorted(unknown))))
+    results = []
+    for image_name, image in images:
+        if image.ndim != 3 or image.shape[2] != 3:
+            raise ValueError("{0} is not an RGB image".format(image_name))
+        pixels = image.shape[0] * image.shape[1]
+        for name in names:
+            try:
+                size, encode_seconds, decode_seconds, peak, stages = _isolated(name, image)
+            except AssertionError as e:
+                raise AssertionError("{0} did not decode {1} losslessly".format(name, image_name)) from e
+            result = {
+                'image': image_name,
+                'codec': name,
+                'pixels': pixels,
+                'bytes': size,
+                'bpp': size * 8 / pixels,
+                'encode_mbps': _megabytes(pixels) / encode_seconds,
+                'decode_mbps': _megabytes(pixels) / decode_seconds,
+                'peak_memory_mb': peak,
+            }
+            result.update(stages)
+            results.append(result)
+    return results
+
+
+def aggregate(results):
+    """Add up the results of each codec over all images, as results with the image named ``*``."""
+    totals = []
+    for name in sorted(set(r['codec'] for r in results)):
+        rows = [r for r in results if r['codec'] == name]
+        pixels = sum(r['pixels'] for r in rows)
+        size = sum(r['bytes'] for r in rows)
+        megabytes = [_megabytes(r['pixels']) for r in rows]
+        total = {
+            'image': '*',
+            'codec': name,
+            'pixels': pixels,
+            'bytes': size,
+            'bpp': size * 8 / pixels,
+            'encode_mbps': sum(megabytes) / sum(m / r['encode_mbps'] for m, r in zip(megabytes, rows)),
+            'decode_mbps': sum(megabytes) / sum(m / r['decode_mbps'] for m, r in zip(megabytes, rows)),
+            'peak_memory_mb': max((r['peak_memory_mb'] for r in rows if r['peak_memory_mb'] is not None), default=None),
+        }
+        for stage in ('predict_seconds', 'entropy_seconds'):
+            if all(stage in r for r in rows):
+                total[stage] = sum(r[stage] for r in rows)
+        totals.append(total)
+    return totals
+
+
+def write_csv(results, file):
+    """Write the results as CSV into a text file object."""
+    writer = csv.DictWriter(file, FIELDS, restval='')
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def test_images():
+    """Get the RGB test images of scikit-image, which don't need to be downloaded."""
+    from skimage import data
+    return [(name, getattr(data, name)()) for name in ('astronaut', 'chelsea', 'coffee', 'rocket')]
@@ -0,0 +1,171 @@
+"""Caches for decoded and compressed images."""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+from plic import __metadata__ as metadata, compression, container
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        """An in-memory cache holding at most `max_bytes` bytes of values.
+
+        When the cache is full, the least recently used values are
+        evicted first. The cache may be shared between threads.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """Get the value of `key`, marking it as the most recently used."""
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value, size=None):
+        """Store `value` under `key`.
+
+        The size of the value defaults to its `nbytes` attribute. Values
+        larger than the whole cache are not stored.
+        """
+        if size is None:
+            size = value.nbytes
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+
+
+def compression_key(image, config):
+    """Hash the pixels of `image` and the settings of `config`, to a key of the result of compressing it."""
+    settings = dict(vars(config))
+    for name in ('shared_codebook', 'fallback_codebook'):
+        if settings[name] is not None:
+            settings[name] = settings[name].id
+    # A pair of ratios and a list of the ratios of two levels are different settings
+    settings['ratio'] = repr(settings['ratio'])
+    digest = hashlib.sha256()
+    # Results of other versions may not be the same
+    digest.update(json.dumps([metadata.version, container.VERSION, settings], sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps([image.shape, image.dtype.str]).encode('utf-8'))
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    # The default size of the cache, in bytes
+    DEFAULT_MAX_BYTES = 2 ** 30
+    EXTENSION = '.plic'
+    # The part of `max_bytes` that the cache is evicted down to when it is full
+    LOW_WATER = 0.9
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """A cache of compressed images in `directory`, holding at most `max_bytes` bytes of containers.
+
+        The files are named by the hash of the image and the settings
+        it was compressed with. When the cache is full, the least
+        recently used files are removed first, until the cache holds at
+        most :data:`LOW_WATER` of `max_bytes`. The cache may be shared
+        between processes.
+
+        The size of the cache is kept as a running total of the files
+        this object writes, and the directory is only scanned when the
+        total goes over `max_bytes`. The scan also counts the files of
+        other processes.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._nbytes = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def get(self, key):
+        """Get the container bytes stored under `key`, or None, marking it as the most recently used."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        """Store the container bytes `data` under `key`, then evict files if the cache is full."""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        # Write to a temporary file first, so that other processes never read a partial file
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+        if self._nbytes is not None:
+            self._nbytes += len(data) - replaced
+        if self._nbytes is None or self._nbytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Scan the cache, and remove the least recently used files if it holds more than `max_bytes`."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.EXTENSION):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        nbytes = sum(size for _, size, _ in entries)
+        if nbytes > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if nbytes <= self.max_bytes * self.LOW_WATER:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                nbytes -= size
+        self._nbytes = nbytes
+
+    def compress(self, image, config=None):
+        """Compress an RGB image with :func:`plic.compression.compress`, and return the container bytes.
+
+        If the same pixels were compressed with the same settings
+        before, the stored result is returned instead.
+        """
+        config = config or compression.CompressionConfig()
+        key = compression_key(image, config)
+        data = self.get(key)
+        if data is None:
+            data = container.dumps(compression.compress(image, config))
+            self.put(key, data)
+        return data
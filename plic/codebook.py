@@ -0,0 +1,136 @@
+"""Huffman codebooks shared between the images of a corpus.
+
+A shared codebook is trained once from a sample of the corpus, and the
+compressed images refer to it by its ID instead of storing their own
+codes. Codebooks are loaded once per process, and are looked up by ID
+in the codebooks that were loaded, then in the directories listed in
+the ``PLIC_CODEBOOK_PATH`` environment variable.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from plic import compression, encoding
+
+# The environment variable listing the directories to look for codebooks in
+PATH_VARIABLE = 'PLIC_CODEBOOK_PATH'
+EXTENSION = '.plicbook'
+
+
+class CodebookNotFound(LookupError):
+    """Raised when a codebook with the given ID is not loaded, and can't be found."""
+
+
+class Codebook:
+    def __init__(self, level_codes, image_code):
+        """Huffman codes shared by many images.
+
+        `level_codes` has the codes of each channel for the error of
+        each level, starting from the full size image. `image_code` is
+        the code for the downsampled image at the top of the pyramid.
+        """
+        self.level_codes = level_codes
+        self.image_code = image_code
+        self._id = None
+
+    @property
+    def id(self):
+        """The ID of the codebook, which is a hash of its codes."""
+        if self._id is None:
+            self._id = hashlib.sha256(self.dumps()).hexdigest()[:16]
+        return self._id
+
+    def error_codes(self, level):
+        """Get the codes of each channel for the error of `level`.
+
+        The levels beyond the ones the codebook was trained with use
+        the codes of the last trained level.
+        """
+        return self.level_codes[min(level, len(self.level_codes) - 1)]
+
+    def dumps(self):
+        """Serialize the codebook to bytes."""
+        return json.dumps({
+            'error_codes': [[encoding.dump_code(code) for code in codes] for codes in self.level_codes],
+            'image_code': encoding.dump_code(self.image_code),
+        }, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    @classmethod
+    def loads(cls, data):
+        """Deserialize a codebook from bytes."""
+        codebook = json.loads(data.decode('utf-8'))
+        return cls(
+            [[encoding.load_code(code) for code in codes] for codes in codebook['error_codes']],
+            encoding.load_code(codebook['image_code']),
+        )
+
+
+def train(images, config=None):
+    """Train a codebook from a sample of RGB images, compressed with `config`.
+
+    Every symbol an 8-bit image may have is given a code, so that the
+    codebook can encode images that are not in the sample. The codebook
+    is made available to the decoders in this process.
+    """
+    error_counts = []
+    image_counts = np.ones(encoding.IMAGE_ALPHABET, dtype=np.int64)
+    for image in images:
+        *errors, downsampled = compression.residuals(image, config)
+        for level, channels in enumerate(errors):
+            if level == len(error_counts):
+                error_counts.append([np.ones(encoding.ERROR_ALPHABET, dtype=np.int64) for _ in channels])
+            for counts, channel in zip(error_counts[level], channels):
+                counts += encoding.count_symbols(channel, alphabet=encoding.ERROR_ALPHABET)
+        image_counts += encoding.count_symbols(downsampled, alphabet=encoding.IMAGE_ALPHABET)
+    return register(Codebook(
+        [[encoding.HuffmanCode.from_counts(counts) for counts in channels] for channels in error_counts],
+        encoding.HuffmanCode.from_counts(image_counts),
+    ))
+
+
+_LOADED = {}
+
+
+def register(codebook):
+    """Make a codebook available to the decoders in this process."""
+    _LOADED[codebook.id] = codebook
+    return codebook
+
+
+def is_registered(codebook_id):
+    """Check whether the codebook with the ID `codebook_id` is available to the decoders in this process."""
+    return codebook_id in _LOADED
+
+
+def unregister(codebook):
+    """Stop making a codebook available to the decoders in this process."""
+    _LOADED.pop(codebook.id, None)
+
+
+def load(path):
+    """Load the codebook in the file at `path`, and make it available to the decoders in this process."""
+    with open(path, 'rb') as f:
+        return register(Codebook.loads(f.read()))
+
+
+def save(codebook, directory):
+    """Save a codebook into `directory`, named after its ID so that it can be found by :func:`get`."""
+    path = os.path.join(directory, codebook.id + EXTENSION)
+    with open(path, 'wb') as f:
+        f.write(codebook.dumps())
+    return path
+
+
+def get(codebook_id):
+    """Get the codebook with the ID `codebook_id`."""
+    if codebook_id not in _LOADED:
+        for directory in os.environ.get(PATH_VARIABLE, '').split(os.pathsep):
+            path = os.path.join(directory, codebook_id + EXTENSION)
+            if directory and os.path.isfile(path):
+                load(path)
+                break
+        else:
+            raise CodebookNotFound("Codebook {0} is not loaded, and is not in {1}".format(codebook_id, PATH_VARIABLE))
+    return _LOADED[codebook_id]
@@ -18,18 +18,74 @@ def rgb2rdgdb(image):
     return new_image
 
 
-def rdgdb2rgb(image):
-    """Converts an image from mRDgDb to RGB color space."""
+def rdgdb2rgb(image, out=None):
+    """Converts an image from mRDgDb to RGB color space.
+
+    The image is written into `out` if it is given, which may be the
+    image itself. Only one channel is allocated while converting.
+    """
     r = image[:,:,0]
     dg = image[:,:,1]
     db = image[:,:,2]
 
-    new_image = np.empty_like(image)
+    if out is None:
+        out = np.empty_like(image)
 
-    g = np.mod(r - dg + 128, 256)
-    b = np.mod(g - db + 128, 256)
-    new_image[:,:,0] = r
-    new_image[:,:,1] = g
-    new_image[:,:,2] = b
+    # The green channel is written over the difference it is found from, which is not needed after it
+    out[:,:,1] = np.mod(r - dg + 128, 256)
+    out[:,:,2] = np.mod(out[:,:,1] - db + 128, 256)
+    out[:,:,0] = r
 
-    return new_image
+    return out
+
+
+def _identity(image, out=None):
+    if out is None or out is image:
+        return image
+    np.copyto(out, image)
+    return out
+
+
+# Conversions from RGB to each color space, and back
+CONVERSIONS = {
+    'rgb': (_identity, _identity),
+    'rdgdb': (rgb2rdgdb, rdgdb2rgb),
+}
+
+
+def from_rgb(image, colorspace):
+    """Converts an image from RGB to `colorspace`."""
+    return CONVERSIONS[colorspace][0](image)
+
+
+def to_rgb(image, colorspace, out=None):
+    """Converts an image from `colorspace` to RGB. An image without a color space is left as it is.
+
+    The image is written into `out` if it is given, which may be the image itself.
+    """
+    if colorspace is None:
+        return _identity(image, out)
+    return CONVERSIONS[colorspace][1](image, out)
+
+
+def _entropy(values):
+    """Find the entropy of the values in an array of bytes, in bits per value."""
+    counts = np.bincount(values.ravel(), minlength=256)
+    p = counts[counts > 0] / values.size
+    return -(p * np.log2(p)).sum()
+
+
+def select(image, step=4):
+    """Find the color space that is expected to compress an RGB image best.
+
+    Each color space is rated by the entropy of the horizontal
+    differences between neighbouring pixels, sampled at every `step` rows.
+    """
+    sample = image[::step]
+
+    def cost(colorspace):
+        converted = from_rgb(sample, colorspace).astype(np.int16)
+        differences = np.mod(np.diff(converted, axis=1), 256).astype(np.uint8)
+        return sum(_entropy(differences[:,:,i]) for i in range(differences.shape[2]))
+
+    return min(sorted(CONVERSIONS), key=cost)
@@ -1,105 +1,613 @@
 """The compression algorithm."""
 
-from math import ceil, floor, log2
+from collections import OrderedDict
+from itertools import repeat
+from math import ceil, floor, inf, log2
 import logging
+from time import perf_counter
 import numpy as np
 from scipy import misc
-from plic import encoding
+from plic import colorspace as colorspaces, encoding
 
 _LOG = logging.getLogger(__name__)
 
+# The methods that the downsampled images can be interpolated with
+INTERPOLATIONS = ('nearest', 'bilinear', 'cubic', 'gap')
+
+
+class CompressionConfig:
+    # The settings of each compression level, from the fastest to the one with the best compression ratio
+    PRESETS = (
+        dict(interpolation='nearest', times=1, codebook='level', entropy='zlib', zlib_level=1),
+        dict(interpolation='nearest', times=1, codebook='level', entropy='huffman'),
+        dict(interpolation='nearest', times=0, codebook='level', entropy='huffman'),
+        dict(interpolation='bilinear', times=0, codebook='channel', entropy='huffman'),
+        dict(interpolation='bilinear', times=0, codebook='channel', entropy='best', zlib_level=1),
+        dict(interpolation='bilinear', times=0, codebook='channel', entropy='best', zlib_level=6, chunk_rows=1024),
+        dict(interpolation='gap', times=0, codebook='channel', entropy='huffman'),
+        dict(interpolation='gap', times=0, codebook='channel', entropy='best', zlib_level=1, chunk_rows=1024),
+        dict(interpolation='gap', times=0, codebook='channel', entropy='best', zlib_level=6, chunk_rows=1024),
+        dict(interpolation='gap', times=0, codebook='channel', entropy='best', zlib_level=9, chunk_rows=1024),
+    )
+    DEFAULT_LEVEL = 5
+
+    def __init__(self, times=0, ratio=2, interpolation='cubic', codebook='level', entropy='huffman', zlib_level=9,
+                 colorspace='rdgdb', chunk_rows=64, shared_codebook=None, code_sample=1, time_budget=None,
+                 fallback_codebook=None):
+        """Settings of the compression algorithm.
+
+        `times` and `ratio` are the depth of the image pyramid and the
+        downsampling ratio, as given to :class:`CompressedImage`. See
+        :func:`ratio_schedule` for the ratios that may be given.
+        `interpolation` is the method used to up-size the downsampled
+        images, one of 'nearest', 'bilinear', 'cubic' or 'gap' for
+        the edge-directed interpolation of :func:`gap_interpolate`.
+
+        `entropy` selects how the errors are encoded: 'huffman',
+        'zlib' with `zlib_level`, or 'best' to try both for each level
+        and keep the smaller one. With Huffman encoding, `codebook`
+        is 'level' to build one code for all channels of a level,
+        'channel' to build one for each channel, or 'shared' to use the
+        codes of the :class:`plic.codebook.Codebook` `shared_codebook`.
+        If `code_sample` is above 1, the codes are built from about one
+        in `code_sample` rows of the data instead of all of it, and every
+        symbol is given a code.
+
+        `colorspace` is the color space the image is converted to
+        before compressing it, or 'auto' to pick the one that is
+        expected to compress best. The error of each channel is split
+        into chunks of `chunk_rows` rows.
+
+        If `time_budget` is given, compressing an image should take at
+        most that many seconds, and cheaper settings are used for the
+        levels that would not be done in time otherwise. The
+        :class:`plic.codebook.Codebook` `fallback_codebook` may be given
+        to use instead of building codes in that case.
+        """
+        assert interpolation in INTERPOLATIONS, "Unknown interpolation {0}".format(interpolation)
+        assert codebook in ('level', 'channel', 'shared'), "Unknown codebook strategy {0}".format(codebook)
+        assert (codebook == 'shared') == (shared_codebook is not None), "A shared codebook needs the 'shared' strategy"
+        assert entropy in encoding.ENTROPY_CODERS + ('best',), "Unknown entropy coder {0}".format(entropy)
+        assert colorspace in tuple(colorspaces.CONVERSIONS) + ('auto',), "Unknown color space {0}".format(colorspace)
+        assert ratio == 'auto' or all(_valid_ratio(r) for r in (ratio if isinstance(ratio, list) else [ratio])), \
+            "Invalid ratio {0}".format(ratio)
+        self.times = times
+        self.ratio = ratio
+        self.interpolation = interpolation
+        self.codebook = codebook
+        self.entropy = entropy
+        self.zlib_level = zlib_level
+        self.colorspace = colorspace
+        self.chunk_rows = chunk_rows
+        self.shared_codebook = shared_codebook
+        self.code_sample = code_sample
+        self.time_budget = time_budget
+        self.fallback_codebook = fallback_codebook
+
+    @classmethod
+    def preset(cls, level=DEFAULT_LEVEL, **kwargs):
+        """Get the settings of compression `level`, between 0 (fastest) and 9 (best compression ratio).
+
+        Any keyword arguments override the settings of the preset.
+        """
+        assert 0 <= level < len(cls.PRESETS), "The compression level must be between 0 and {0}".format(
+            len(cls.PRESETS) - 1)
+        # The presets choose the ratios of the levels from the image
+        settings = dict(cls.PRESETS[level], ratio='auto')
+        settings.update(kwargs)
+        return cls(**settings)
+
+    def replace(self, **kwargs):
+        """Get a copy of the settings, with the settings in the keyword arguments replaced."""
+        settings = dict(vars(self))
+        settings.update(kwargs)
+        return CompressionConfig(**settings)
+
+    def entropy_coders(self):
+        """Get the entropy coders that should be tried."""
+        return encoding.ENTROPY_CODERS if self.entropy == 'best' else (self.entropy,)
+
+
+def _decode(entropy, encoded, code, count, dtype):
+    """Decode a bitstream of symbols of type `dtype` that was encoded by `entropy`."""
+    if entropy == 'zlib':
+        return encoding.inflate(encoded, dtype, count)
+    return encoding.decode(encoded, code, count)
+
+
+def _size(encoded):
+    return sum(len(e) for chunks in encoded for e in chunks)
+
+
+def _codebook_id(entropy, config):
+    """Get the ID of the shared codebook that a bitstream was encoded with, if any."""
+    if entropy == 'huffman' and config.codebook == 'shared':
+        return config.shared_codebook.id
+    return None
+
+
+def _error_codes(channels, config, level):
+    """Build the Huffman codes for each channel of the error of `level`, given as arrays of the folded errors."""
+    if config.codebook == 'shared':
+        return config.shared_codebook.error_codes(level)
+    # Codes built from a sample need codes for the symbols that weren't sampled
+    escape = config.code_sample > 1
+    if config.codebook == 'channel':
+        return [encoding.build_code(channel, alphabet=encoding.ERROR_ALPHABET, escape=escape) for channel in channels]
+    return [encoding.build_code(*channels, alphabet=encoding.ERROR_ALPHABET, escape=escape)] * len(channels)
+
+
+def _sampled_error_codes(folded, mask, config, level):
+    """Build the Huffman codes for each channel of the folded error of `level`, from the rows sampled by `config`."""
+    if config.codebook == 'shared':
+        return config.shared_codebook.error_codes(level)
+    rows = encoding.sample_rows(len(mask), config.code_sample, seed=level)
+    folded, mask = folded[rows], mask[rows]
+    return _error_codes([folded[:,:,i][mask] for i in range(folded.shape[2])], config, level)
+
+
+def _image_code(data, config):
+    """Build the Huffman code for the downsampled image at the top of the pyramid."""
+    if config.codebook == 'shared':
+        return config.shared_codebook.image_code
+    return encoding.build_code(data, alphabet=encoding.IMAGE_ALPHABET, step=config.code_sample)
+
+
+def _pair(ratio):
+    """Get a downsampling ratio as a pair of the vertical and horizontal ratios."""
+    return (ratio, ratio) if isinstance(ratio, int) else tuple(ratio)
+
+
+def _ratio(ry, rx):
+    """Get the downsampling ratio with the vertical ratio `ry` and the horizontal ratio `rx`.
+
+    Equal ratios are given as one integer, so that square ratios are
+    stored the same way as before ratios could differ along each axis.
+    """
+    return ry if ry == rx else (ry, rx)
+
+
+def _valid_ratio(ratio):
+    ry, rx = _pair(ratio)
+    return min(ry, rx) >= 1 and max(ry, rx) > 1
+
+
+def _times(shape, times, ratio=2):
+    """Find the depth of the recursion for an image of `shape` downsampled by `ratio`, if `times` is 0.
+
+    The image is downsampled until it is about 256 pixels high and wide.
+    """
+    if times == 0:
+        m, n, _ = shape
+        depths = [log2(size / 256) / log2(r) for size, r in zip((m, n), _pair(ratio)) if r > 1]
+        times = floor(min(depths))
+    return times
+
+
+# The number of pixels of a batch of images that are interpolated at once, so that the intermediate arrays stay in the
+# cache. Small images are much faster to interpolate in blocks, while the blocks of large images are single images.
+_BATCH_PIXELS = 2 ** 14
+# How many times smaller the gradient along an axis must be than across it for the axis to be downsampled by 4
+_ANISOTROPY = 3.5
+# The gradient at which the pixels are too noisy to be predicted, so that a level does not pay off
+_NOISY_GRADIENT = 24
+# The smallest size the image at the top of the pyramid is downsampled to, when the ratios are chosen automatically
+_MIN_SIZE = 64
+
+
+def _gradients(image, step=4):
+    """Find the mean absolute difference of vertically and horizontally neighboring pixels, in a sample of `image`."""
+    rows, columns = image[..., ::step, :, :].astype(np.int16), image[..., ::step, :].astype(np.int16)
+    vertical = np.abs(np.diff(columns, axis=-3)).mean() if image.shape[-3] > 1 else inf
+    horizontal = np.abs(np.diff(rows, axis=-2)).mean() if image.shape[-2] > 1 else inf
+    return vertical, horizontal
+
+
+def _auto_schedule(image, times):
+    """Choose the ratio of each level of the pyramid of `image` from its gradients.
+
+    An axis along which the image is much smoother than across it is
+    downsampled by 4, and by 2 otherwise. If `times` is 0, levels are
+    added until the image is about :data:`_MIN_SIZE` pixels high and
+    wide, or too noisy for predicting it to pay off.
+    """
+    ratios = []
+    while not times or len(ratios) < times:
+        vertical, horizontal = _gradients(image)
+        m, n = image.shape[-3:-1]
+        ry = 4 if vertical * _ANISOTROPY <= horizontal and (times or m >= 4 * _MIN_SIZE) else 2
+        rx = 4 if horizontal * _ANISOTROPY <= vertical and (times or n >= 4 * _MIN_SIZE) else 2
+        too_small = min(ceil(m / ry), ceil(n / rx)) < _MIN_SIZE
+        if not times and ratios and (too_small or min(vertical, horizontal) >= _NOISY_GRADIENT):
+            break
+        ratios.append(_ratio(ry, rx))
+        image = image[..., ::ry, ::rx, :]
+    return times or len(ratios), ratios
+
+
+def parse_ratio(text):
+    """Parse a ratio given as ``R`` or ``RYxRX``, a comma separated list of the ratios of each level, or 'auto'."""
+    if text == 'auto':
+        return text
+    ratios = []
+    for level in text.split(','):
+        ratio = tuple(int(r) for r in level.lower().split('x'))
+        if len(ratio) == 1:
+            ratio *= 2
+        if len(ratio) != 2 or not _valid_ratio(ratio):
+            raise ValueError("Invalid ratio: {0}".format(level))
+        ratios.append(_ratio(*ratio))
+    return ratios if len(ratios) > 1 else ratios[0]
+
+
+def ratio_schedule(image, times=0, ratio=2):
+    """Find the depth of the pyramid of `image`, and the downsampling ratio of each of its levels.
+
+    A ratio is an integer, or a tuple of the vertical and the
+    horizontal ratios. `ratio` is the ratio of every level, a list of
+    the ratios of each level where the last one is repeated for the
+    levels past its end, or 'auto' to choose the ratio of each level
+    from the gradients of the image. If `times` is 0, the depth is
+    the length of the list, or is chosen from the size of the image.
+
+    Returns the depth and the list of ratios, which has a ratio for at
+    least one level. `image` may also be a batch of images of the same
+    size, stacked along a first axis, to find the ratios of all of them.
+    """
+    if ratio == 'auto':
+        return _auto_schedule(image, times)
+    if isinstance(ratio, list):
+        times = times or len(ratio)
+        ratios = ratio[:times] + ratio[-1:] * (times - len(ratio))
+    else:
+        times = _times(image.shape[-3:], times, ratio)
+        ratios = [ratio] * max(times, 1)
+    return times, [_ratio(*_pair(r)) for r in ratios]
+
+
+def _blend(along_a, along_b, gradient_a, gradient_b, low=4, high=16):
+    """Blend the predictions that interpolate along two directions, favoring the one with the smaller gradient.
+
+    The predictions are averaged while the difference of the gradients
+    is below `low`, and the smoother direction is used alone once it is
+    above `high`, as in the gradient adjusted prediction of CALIC.
+    """
+    weight = np.clip((gradient_b - gradient_a - low) / (high - low), 0, 1) - \
+        np.clip((gradient_a - gradient_b - low) / (high - low), 0, 1)
+    average = (along_a + along_b) / 2
+    return average + np.where(weight > 0, weight * (along_a - average), -weight * (along_b - average))
+
+
+def gap_interpolate(image, shape, t):
+    """Up-size an image that was downsampled by the ratio `t` to the size of `shape`, following its edges.
+
+    Each pixel between four pixels of `image` is interpolated along the
+    diagonal with the smaller gradient. The pixels between two pixels
+    of `image` in a row or a column are then interpolated along the row
+    or across it from the pixels found before, again favoring the
+    direction with the smaller gradient. `image` may be a batch of
+    images stacked along a first axis, which are all up-sized at once.
+    """
+    batch = ((0, 0),) * (image.ndim - 3)
+    # Repeat the last row and column, so that the pixels past the last ones of the image have four corners
+    padded = np.pad(image.astype(np.float64), batch + ((0, 1), (0, 1), (0, 0)), mode='edge')
+    corners = (padded[..., :-1, :-1, :], padded[..., :-1, 1:, :], padded[..., 1:, :-1, :], padded[..., 1:, 1:, :])
+    # The corners of each cell, and the position of the pixels in the cells, as (row, y, column, x, channel)
+    a, b, c, d = (p[..., :, None, :, None, :] for p in corners)
+    ty, tx = _pair(t)
+    x = (np.arange(tx) / tx)[None, None, None, :, None]
+    y = (np.arange(ty) / ty)[None, :, None, None, None]
+    top, bottom = a + x * (b - a), c + x * (d - c)
+    bilinear = top + y * (bottom - top)
+    # Interpolate along the diagonal from a to d, and the one from b to c
+    across = x - y
+    along_ad = (a + d) / 2 + np.where(across >= 0, across * (b - (a + d) / 2), -across * (c - (a + d) / 2))
+    across = x + y - 1
+    along_bc = (b + c) / 2 + np.where(across <= 0, -across * (a - (b + c) / 2), across * (d - (b + c) / 2))
+    diagonal = _blend(along_ad, along_bc, np.abs(a - d), np.abs(b - c))
+    rows, _, columns, _, channels = bilinear.shape[-5:]
+    resized = np.where((x > 0) & (y > 0), diagonal, bilinear)
+    resized = resized.reshape(bilinear.shape[:-5] + (rows * ty, columns * tx, channels))
+
+    around = np.pad(resized, batch + ((1, 1), (1, 1), (0, 0)), mode='edge')
+    up, down = around[..., :-2, 1:-1, :], around[..., 2:, 1:-1, :]
+    left, right = around[..., 1:-1, :-2, :], around[..., 1:-1, 2:, :]
+    vertical, horizontal = np.abs(up - down), np.abs(left - right)
+    on_row = (np.arange(rows * ty) % ty == 0)[:, None, None] & (np.arange(columns * tx) % tx != 0)[None, :, None]
+    on_column = (np.arange(rows * ty) % ty != 0)[:, None, None] & (np.arange(columns * tx) % tx == 0)[None, :, None]
+    # The pixels on the rows and columns of the image are already interpolated along them
+    along_rows = _blend(resized, (up + down) / 2, horizontal, vertical)
+    along_columns = _blend(resized, (left + right) / 2, vertical, horizontal)
+    resized = np.where(on_row, along_rows, np.where(on_column, along_columns, resized))
+
+    m, n = shape[-3:-1]
+    # The images are 8-bit
+    return np.clip(np.round(resized[..., :m, :n, :]), 0, 255).astype(image.dtype)
+
 
 class EncodedError:
     @staticmethod
     def _error_mask(shape, t):
-        """"Find a mask that will give the pixels that have error when interpolating up to `shape` by order `t`."""
+        """"Find a mask that will give the pixels that have error when interpolating up to `shape` by ratio `t`."""
         m, n, c = shape
+        ty, tx = _pair(t)
         assert c == 3, "The image must have 3 color channels"
-        mask = np.ones(m * n, dtype=bool)
-        nrow = ceil(n / t)
-        ncol = ceil(m / t)
-        for i in range(0, nrow * ncol):
-            # nrow pixels to be deleted in any row, t pixels between each pixel to be deleted
-            irow = (i % nrow) * t
-            # t pixels in a row before we go to the next row, t rows to skip with n pixels each
-            icol = (i // nrow) * n * t
-            mask[irow + icol] = False
-            return mask
-
-    def __init__(self, error, ratio):
-        """Encode an error matrix that was created after a `ratio` downsampling."""
+        mask = np.ones((m, n), dtype=bool)
+        # The pixels of the downsampled image are inserted as they are when interpolating, so they have no error
+        mask[::ty, ::tx] = False
+        return mask
+
+    def _chunks(self):
+        """Get the first and last rows of each chunk."""
+        m = self.shape[0]
+        return [(start, min(start + self.chunk_rows, m)) for start in range(0, m, self.chunk_rows)]
+
+    def _encode(self, channels, mask, entropy, config, codes):
+        """Encode the chunks of each channel with `entropy`, and return the codes used for each channel."""
+        chunks = [[channel[start:stop][mask[start:stop]] for start, stop in self._chunks()] for channel in channels]
+        if entropy == 'zlib':
+            encoded = [[encoding.deflate(c, config.zlib_level) for c in cs] for cs in chunks]
+            return [None] * len(channels), encoded
+        encoded = [[encoding.encode(c, code) for c in cs] for cs, code in zip(chunks, codes)]
+        return codes, encoded
+
+    def __init__(self, error, ratio, config=None, level=0, codes=None):
+        """Encode an error matrix that was created after a `ratio` downsampling.
+
+        Each channel is split into chunks of rows, which are encoded
+        separately so that they can be decoded in parallel. `level` is
+        the position of the error in the image pyramid. The Huffman
+        `codes` of each channel are built from the error if omitted.
+
+        The error is folded into unsigned symbols by
+        :func:`plic.encoding.zigzag` before it is encoded.
+        """
+        config = config or CompressionConfig()
         self.shape = error.shape
         self.ratio = ratio
+        self.chunk_rows = config.chunk_rows
         mask = self._error_mask(self.shape, ratio)
-        channels = (
-            error[:,:,0].ravel()[mask],
-            error[:,:,1].ravel()[mask],
-            error[:,:,2].ravel()[mask],
-        )
-        self.code = encoding.build_dictionary(*channels)
-        self.encoded = []
-        for channel in channels:
-            self.encoded.append(encoding.encode(channel, self.code))
+        folded = encoding.zigzag(error)
+        channels = (folded[:,:,0], folded[:,:,1], folded[:,:,2])
+        if codes is None and 'huffman' in config.entropy_coders():
+            codes = _sampled_error_codes(folded, mask, config, level)
+        candidates = [(e,) + self._encode(channels, mask, e, config, codes) for e in config.entropy_coders()]
+        self.entropy, self.codes, self.encoded = min(candidates, key=lambda c: _size(c[2]))
+        self.codebook_id = _codebook_id(self.entropy, config)
         _LOG.info(
-            "Error encoding: encoded %s bytes to %s bytes",
-            sum(map(lambda c: c.nbytes, channels)),
-            sum(map(lambda e: len(e), self.encoded)),
+            "Error encoding: encoded %s bytes to %s bytes with %s",
+            np.count_nonzero(mask) * len(channels) * folded.itemsize,
+            _size(self.encoded),
+            self.entropy,
         )
 
-    def _deprocess_error_channel(self, err, mask):
-        """Insert the deleted zeroes into the error channels."""
-        m, n, _ = self.shape
-        channel = np.zeros(m * n)
-        channel[mask] = err
-        return channel.reshape((m, n))
+    def _decode_into(self, folded, mask, executor=None, codes=None):
+        """Decode the folded errors into the pixels of `folded` that are selected by `mask`.
 
-    def reconstruct(self):
-        """Convert the encoded error back to the error matrix."""
-        m, n, _ = self.shape
-        mask = self._error_mask(self.shape, self.ratio)
-        error = np.empty(self.shape)
-        for i, channel in enumerate(self.encoded):
-            decoded = encoding.decode(channel, self.code)[:m * n - 1]
-            error[:,:,i] = self._deprocess_error_channel(decoded, mask)
-        return error
+        The Huffman `codes` of each channel may be given to decode with
+        instead of the codes of the error, which must be the same codes.
+        """
+        codes = self.codes if codes is None else codes
+        jobs = [(i, start, stop) for i in range(len(self.encoded)) for start, stop in self._chunks()]
+        chunks = [chunk for channel in self.encoded for chunk in channel]
+        counts = [np.count_nonzero(mask[start:stop]) for _, start, stop in jobs]
+        decode = map if executor is None else executor.map
+        chunk_codes = [codes[i] for i, _, _ in jobs]
+        decoded = decode(_decode, repeat(self.entropy), chunks, chunk_codes, counts, repeat(np.uint16))
+        for (i, start, stop), values in zip(jobs, decoded):
+            folded[start:stop,:,i][mask[start:stop]] = values
+
+    def reconstruct(self, executor=None):
+        """Convert the encoded error back to the error matrix.
+
+        The chunks are decoded with the `map` of `executor` if one is
+        given, so that they can be decoded by multiple threads or processes.
+        """
+        folded = np.zeros(self.shape, dtype=np.uint16)
+        self._decode_into(folded, self._error_mask(self.shape, self.ratio), executor)
+        return encoding.unzigzag(folded)
 
 
 class EncodedImage:
-    def __init__(self, image):
-        """Encode an image with Huffman encoding."""
+    def __init__(self, image, config=None, code=None):
+        """Encode an image with Huffman encoding, or the entropy coder chosen by `config`.
+
+        The Huffman `code` is built from the image if omitted.
+        """
+        config = config or CompressionConfig()
         data = image.ravel()
         self.shape = image.shape
-        self.code = encoding.build_dictionary(data)
-        self.encoded = encoding.encode(data, self.code)
+        self.dtype = image.dtype
+        candidates = []
+        for entropy in config.entropy_coders():
+            if entropy == 'zlib':
+                candidates.append((entropy, None, encoding.deflate(data, config.zlib_level)))
+            else:
+                code = code or _image_code(data, config)
+                candidates.append((entropy, code, encoding.encode(data, code)))
+        self.entropy, self.code, self.encoded = min(candidates, key=lambda c: len(c[2]))
+        self.codebook_id = _codebook_id(self.entropy, config)
         _LOG.info(
-            "Image encoding: encoded %s bytes to %s bytes",
+            "Image encoding: encoded %s bytes to %s bytes with %s",
             data.nbytes,
-            len(self.encoded)
+            len(self.encoded),
+            self.entropy,
         )
 
-    def reconstruct(self):
+    @property
+    def depth(self):
+        """The number of levels in the image pyramid."""
+        return 1
+
+    def level(self, level):
+        """Get the part of the image pyramid that starts at `level`."""
+        assert not level, "Level {0} is beyond the top of the image pyramid".format(level)
+        return self
+
+    def reconstruct(self, level=None, executor=None):
         """Convert the encoded image back to the original matrix form."""
+        assert not level, "Level {0} is beyond the top of the image pyramid".format(level)
         m, n, c = self.shape
-        image = encoding.decode(self.encoded, self.code)[:m * n * c].reshape(self.shape)
-        return image
+        image = _decode(self.entropy, self.encoded, self.code, m * n * c, self.dtype).reshape(self.shape)
+        return image.astype(self.dtype, copy=False)
+
+
+class _Budget:
+    # The number of pixels that the cost of new settings is measured on, in whole rows from the middle of the image
+    SAMPLE_PIXELS = 2 ** 16
+    # Cheaper interpolations to fall back to
+    CHEAPER_INTERPOLATION = {'gap': 'bilinear', 'cubic': 'bilinear', 'bilinear': 'nearest'}
+
+    def __init__(self, seconds):
+        """Keep track of the time left for compressing an image, and the fallbacks taken to stay within it.
+
+        The seconds per pixel that predicting and encoding take with
+        each setting are measured as the levels are compressed, and on
+        a sample of the image for the settings that were not used yet.
+        If the budget is exceeded anyway, that is recorded in the
+        fallbacks too.
+        """
+        self.deadline = perf_counter() + seconds
+        self.fallbacks = []
+        self.exceeded = False
+        self._predict_rates = {}
+        self._encode_rates = {}
+
+    @staticmethod
+    def _encode_key(config):
+        return config.entropy, config.zlib_level, config.codebook
+
+    def measure(self, config, pixels, predict_seconds, encode_seconds):
+        """Record the time predicting and encoding `pixels` pixels took with `config`."""
+        self._predict_rates[config.interpolation] = predict_seconds / pixels
+        self._encode_rates[self._encode_key(config)] = encode_seconds / pixels
+
+    def _rates(self, image, config, ratio):
+        """Get the seconds per pixel for predicting and encoding with `config`."""
+        if config.interpolation not in self._predict_rates or self._encode_key(config) not in self._encode_rates:
+            rows = ceil(self.SAMPLE_PIXELS / image.shape[1])
+            start = max(0, (image.shape[0] - rows) // 2)
+            sample = image[start:start + rows]
+            start = perf_counter()
+            _, error = CompressedImage.predict(sample, ratio, config.interpolation)
+            predicted = perf_counter()
+            EncodedError(error, ratio, config)
+            self.measure(config, sample.shape[0] * sample.shape[1], predicted - start, perf_counter() - predicted)
+        return self._predict_rates[config.interpolation], self._encode_rates[self._encode_key(config)]
+
+    def _estimate(self, image, config, times, ratios):
+        """Estimate the seconds compressing `image` and the levels above it with `ratios` would take."""
+        predict, encode = self._rates(image, config, ratios[0])
+        m, n = image.shape[:2]
+        seconds = 0
+        for ratio in ratios[:max(times, 1)]:
+            seconds += m * n * (predict + encode)
+            ry, rx = _pair(ratio)
+            m, n = ceil(m / ry), ceil(n / rx)
+        return seconds + m * n * encode
+
+    def _fallback(self, config):
+        """Find the next cheaper settings as ``(description, config)``, or None if there are none."""
+        if config.entropy != 'huffman':
+            return 'entropy {0} -> huffman'.format(config.entropy), config.replace(entropy='huffman')
+        if config.fallback_codebook is not None and config.codebook != 'shared':
+            shared = config.replace(codebook='shared', shared_codebook=config.fallback_codebook)
+            return 'codebook {0} -> shared'.format(config.codebook), shared
+        cheaper = self.CHEAPER_INTERPOLATION.get(config.interpolation)
+        if cheaper:
+            description = 'interpolation {0} -> {1}'.format(config.interpolation, cheaper)
+            return description, config.replace(interpolation=cheaper)
+        return None
+
+    def _exceed(self, level):
+        """Record that the budget is exceeded at `level`, the first time it is."""
+        if not self.exceeded:
+            self.exceeded = True
+            self.fallbacks.append('level {0}: budget exceeded'.format(level))
+            _LOG.info("Time budget: exceeded at level %s", level)
+
+    def plan(self, image, config, times, ratios, level):
+        """Choose the settings for compressing `level` of the pyramid with `ratios`, so that it can be done in time.
+
+        The settings are chosen from the costs measured so far, which
+        include the levels that were already compressed. Returns the
+        settings, or the cheapest ones if none of them can be done in
+        time.
+        """
+        while self._estimate(image, config, times, ratios) > self.deadline - perf_counter():
+            fallback = self._fallback(config)
+            if fallback is None:
+                self._exceed(level)
+                break
+            description, config = fallback
+            self.fallbacks.append('level {0}: {1}'.format(level, description))
+            _LOG.info("Time budget: falling back at level %s to %s", level, description)
+        return config
+
+    def finish(self, level):
+        """Record whether the budget was exceeded, once the top `level` of the pyramid is compressed."""
+        if perf_counter() > self.deadline:
+            self._exceed(level)
 
 
 class CompressedImage:
+    # The fallbacks that were taken to compress within the time budget
+    fallbacks = ()
+
     @staticmethod
     def downsample(image, t):
-        """Downsample an image by skipping `t` pixels."""
-        return np.copy(image[::t,::t,:])
+        """Downsample an image by the ratio `t`, skipping as many pixels as the ratio of each axis."""
+        ty, tx = _pair(t)
+        return np.copy(image[::ty,::tx,:])
 
     @staticmethod
-    def interpolate(image, shape, t):
-        """Up-size an image to size of `shape`."""
+    def interpolate(image, shape, t, interpolation='cubic'):
+        """Up-size an image to size of `shape`.
+
+        `image` may be a batch of images stacked along a first axis,
+        with `shape` the shape of the batch. The edge-directed
+        interpolation up-sizes blocks of about :data:`_BATCH_PIXELS`
+        pixels of the batch at once, while the other interpolations
+        are done by PIL one image at a time.
+        """
         assert type(shape) is tuple, "Interpolation must be done to a shape"
-        resized = misc.imresize(image, shape, interp='cubic')
+        if interpolation == 'gap' and image.ndim > 3:
+            step = max(_BATCH_PIXELS // (shape[1] * shape[2]), 1)
+            resized = np.concatenate([
+                gap_interpolate(image[i:i + step], shape[1:], t) for i in range(0, len(image), step)
+            ])
+        elif interpolation == 'gap':
+            resized = gap_interpolate(image, shape, t)
+        elif image.ndim > 3:
+            resized = np.stack([misc.imresize(i, shape[1:], interp=interpolation) for i in image])
+        else:
+            resized = misc.imresize(image, shape, interp=interpolation)
         # Insert the pixels that are certain to be correct
-        resized[::t,::t,:] = image
+        ty, tx = _pair(t)
+        resized[...,::ty,::tx,:] = image
         return resized
 
-    def __init__(self, image, times=0, ratio=2):
+    @classmethod
+    def predict(cls, image, ratio, interpolation):
+        """Downsample an image, and find the error of interpolating it back up."""
+        downsampled = cls.downsample(image, t=ratio)
+        rescaled = cls.interpolate(downsampled, image.shape, ratio, interpolation)
+        return downsampled, image.astype(np.int32) - rescaled
+
+    @classmethod
+    def from_parts(cls, error, downsampled, times, interpolation, colorspace=None):
+        """Create a compressed image from its encoded error and the compressed image of the level above it."""
+        compressed = cls.__new__(cls)
+        compressed.times = times
+        compressed.ratio = error.ratio
+        compressed.interpolation = interpolation
+        compressed.shape = error.shape
+        compressed.colorspace = colorspace
+        compressed.error = error
+        compressed.downsampled = downsampled
+        return compressed
+
+    def __init__(self, image, times=None, ratio=None, colorspace=None, config=None, level=0, budget=None):
         """Compress an image.
 
         The compression operation will be performed recursively. The
@@ -109,26 +617,358 @@ class CompressedImage:
         compressed again using the algorithm.
 
         Ratio is the downsampling ratio. Higher values are better for
-        less detailed images.
+        less detailed images. It may differ along each axis, and for
+        each level of the pyramid, see :func:`ratio_schedule`.
+
+        The rest of the settings are taken from `config`, which also
+        gives `times` and `ratio` if they are omitted. The name of the
+        color space of the image may be given as `colorspace`, so that
+        the image can be converted back to RGB when it is decompressed.
+        `level` is the position of the image in the pyramid.
+
+        If `config` has a time budget, the settings of each level may
+        fall back to cheaper ones to stay within it, and the fallbacks
+        that were taken are listed in `fallbacks`, followed by whether
+        the budget was exceeded anyway. The seconds each
+        stage of the level took are given in `timings`.
         """
-        if times == 0:
-            m, n, _ = image.shape
-            times = floor(min(log2(m / 256), log2(n / 256)))
+        config = config or CompressionConfig()
+        if times is None:
+            times = config.times
+        if ratio is None:
+            ratio = config.ratio
+        times, ratios = ratio_schedule(image, times, ratio)
+        if budget is None and config.time_budget is not None:
+            budget = _Budget(config.time_budget)
+        if budget is not None:
+            config = budget.plan(image, config, times, ratios, level)
+            self.fallbacks = budget.fallbacks
         self.times = times
-        self.ratio = ratio
+        self.ratio = ratio = ratios[0]
+        self.interpolation = config.interpolation
         self.shape = image.shape
-        downsampled = self.downsample(image, t=ratio)
-        rescaled = self.interpolate(downsampled, image.shape, ratio)
-        self.error = EncodedError(image.astype(np.int32) - rescaled, ratio)
+        self.colorspace = colorspace
+        start = perf_counter()
+        downsampled, error = self.predict(image, ratio, self.interpolation)
+        predicted = perf_counter()
+        self.error = EncodedError(error, ratio, config, level)
+        self.timings = {'predict': predicted - start, 'encode': perf_counter() - predicted}
+        _LOG.info("Level %s: predicted in %.3fs, encoded in %.3fs", level, self.timings['predict'],
+                  self.timings['encode'])
+        if budget is not None:
+            budget.measure(config, image.shape[0] * image.shape[1], self.timings['predict'], self.timings['encode'])
         # If we're not recursing anymore, store the actual downsampled image
         if self.times <= 1:
-            self.downsampled = EncodedImage(downsampled)
+            self.downsampled = EncodedImage(downsampled, config)
+            if budget is not None:
+                budget.finish(level + 1)
         else:
-            self.downsampled = CompressedImage(downsampled, times - 1, ratio)
-
-    def reconstruct(self):
-        """Decompress the image."""
-        downsampled = self.downsampled.reconstruct()
-        error = self.error.reconstruct()
-        rescaled = self.interpolate(downsampled, self.shape, self.ratio)
-        return rescaled + error
+            self.downsampled = CompressedImage(
+                downsampled, times - 1, ratios[1:], config=config, level=level + 1, budget=budget)
+
+    @property
+    def depth(self):
+        """The number of levels in the image pyramid."""
+        return 1 + self.downsampled.depth
+
+    def reconstruct(self, level=None, executor=None):
+        """Decompress the image.
+
+        Level 0 is the full size image, and each level above it is
+        downsampled once more. If `level` is given, the decompression
+        stops at that level of the image pyramid. The error chunks are
+        decoded using `executor` if one is given.
+        """
+        if level:
+            return self.downsampled.reconstruct(level - 1, executor)
+        return self.expand(self.downsampled.reconstruct(executor=executor), executor)
+
+    def level(self, level):
+        """Get the part of the image pyramid that starts at `level`."""
+        if level:
+            return self.downsampled.level(level - 1)
+        return self
+
+    def expand(self, downsampled, executor=None):
+        """Reconstruct this level of the pyramid from the reconstruction of the level above it."""
+        error = self.error.reconstruct(executor)
+        rescaled = self.interpolate(downsampled, self.shape, self.ratio, self.interpolation)
+        # Keep the type of the downsampled image, so that the next level interpolates the same way it was compressed
+        return (rescaled + error).astype(downsampled.dtype, copy=False)
+
+
+class ProgressiveDecoder:
+    def __init__(self, compressed):
+        """Decode a compressed image one level at a time, starting from the top of the pyramid.
+
+        Each call to `refine` decodes only the error of the next level,
+        and interpolates the current reconstruction up to its size.
+        """
+        self.compressed = compressed
+        self.level = compressed.depth - 1
+        self.image = compressed.reconstruct(self.level)
+
+    @property
+    def done(self):
+        """Whether the full size image has been decoded."""
+        return self.level == 0
+
+    def refine(self):
+        """Decode the next finer level of the pyramid, and return it."""
+        assert not self.done, "The image is already fully decoded"
+        self.level -= 1
+        self.image = self.compressed.level(self.level).expand(self.image)
+        return self.image
+
+
+class Decoder:
+    def __init__(self, executor=None, max_codes=256):
+        """Decode compressed images, keeping what decoding needs between calls.
+
+        Scratch buffers are pooled by their shape, and the error masks
+        and the decode tables of up to `max_codes` Huffman codes are
+        cached, so that decoding more images of the same sizes does not
+        allocate them again. The error chunks are decoded with the `map`
+        of `executor` if one is given.
+
+        A decoder must not be used by more than one thread at a time,
+        each thread should have its own.
+        """
+        self.executor = executor
+        self.max_codes = max_codes
+        self._buffers = {}
+        self._masks = {}
+        self._codes = OrderedDict()
+
+    def _buffer(self, name, shape, dtype):
+        """Get the scratch buffer `name` for `shape`. Buffers are zeroed only when they are created."""
+        key = (name, shape, np.dtype(dtype))
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = np.zeros(shape, dtype=dtype)
+        return buffer
+
+    def _mask(self, shape, t):
+        key = (shape, t)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._masks[key] = EncodedError._error_mask(shape, t)
+        return mask
+
+    def _code(self, code):
+        """Get the cached copy of a Huffman code, which keeps its decode table."""
+        if code is None:
+            return None
+        key = code.lengths.tobytes()
+        cached = self._codes.get(key)
+        if cached is None:
+            cached = self._codes[key] = code
+            if len(self._codes) > self.max_codes:
+                self._codes.popitem(last=False)
+        else:
+            self._codes.move_to_end(key)
+        return cached
+
+    def clear(self):
+        """Release the pooled buffers and the cached masks and codes."""
+        self._buffers.clear()
+        self._masks.clear()
+        self._codes.clear()
+
+    def expand(self, compressed, downsampled, out=None):
+        """Reconstruct a level of the pyramid from the reconstruction of the level above it.
+
+        This is the same as :meth:`CompressedImage.expand`, writing the
+        level into `out` if it is given.
+        """
+        shape, ratio = compressed.shape, compressed.ratio
+        error = compressed.error
+        # The pixels that aren't in the mask stay 0 in the buffer, so it is kept for each ratio
+        folded = self._buffer(('folded', ratio), shape, np.uint16)
+        error._decode_into(folded, self._mask(shape, ratio), self.executor, [self._code(c) for c in error.codes])
+        # Unfold the errors in place, as encoding.unzigzag does
+        values = self._buffer('values', shape, np.int32)
+        signs = self._buffer('signs', shape, np.int32)
+        np.bitwise_and(folded, 1, out=signs)
+        np.negative(signs, out=signs)
+        np.right_shift(folded, 1, out=values)
+        np.bitwise_xor(values, signs, out=values)
+        np.add(values, compressed.interpolate(downsampled, shape, ratio, compressed.interpolation), out=values)
+        if out is None:
+            out = np.empty(shape, dtype=downsampled.dtype)
+        np.copyto(out, values, casting='unsafe')
+        return out
+
+    def reconstruct(self, compressed, level=None, out=None):
+        """Decompress `compressed` up to `level`, as :meth:`CompressedImage.reconstruct` does.
+
+        The levels above the requested one are reconstructed into pooled
+        buffers. The requested level is written into `out` if it is
+        given, and into a new array otherwise.
+        """
+        levels = [compressed.level(i) for i in range(level or 0, compressed.depth)]
+        top = levels[-1]
+        m, n, c = top.shape
+        image = _decode(top.entropy, top.encoded, self._code(top.code), m * n * c, top.dtype)
+        image = image.reshape(top.shape).astype(top.dtype, copy=False)
+        if len(levels) == 1 and out is not None:
+            np.copyto(out, image, casting='unsafe')
+            return out
+        for i in reversed(range(len(levels) - 1)):
+            target = out if i == 0 else self._buffer('image', levels[i].shape, image.dtype)
+            image = self.expand(levels[i], image, target)
+        return image
+
+
+def as_image(data, shape=None):
+    """View `data` as an image without copying it.
+
+    `data` is an array, such as a :class:`numpy.memmap`, or any object
+    with the buffer protocol that holds the 8-bit pixels of an image of
+    `shape`.
+    """
+    if isinstance(data, np.ndarray):
+        return data
+    return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+
+
+def _to_colorspace(image, config):
+    """Convert an RGB image to the color space chosen by `config`, and return its name with the converted image."""
+    colorspace = config.colorspace
+    if colorspace == 'auto':
+        colorspace = colorspaces.select(image)
+    return colorspace, colorspaces.from_rgb(image, colorspace)
+
+
+def compress(image, config=None, shape=None):
+    """Compress an RGB image, converting it to the color space chosen by `config` first.
+
+    The image may be given as a buffer of pixels of `shape`, see :func:`as_image`.
+    """
+    config = config or CompressionConfig()
+    colorspace, converted = _to_colorspace(as_image(image, shape), config)
+    return CompressedImage(converted, colorspace=colorspace, config=config)
+
+
+def compress_many(images, config=None):
+    """Compress a batch of RGB images of the same size.
+
+    The images are downsampled and their errors are found together, and
+    the Huffman codes of each level are built once from the combined
+    errors of the batch. The ratios of the levels are chosen for the
+    whole batch. Each compressed image still holds its own codes,
+    unless a shared codebook is used. A time budget is not supported,
+    as the images are not compressed one at a time.
+    """
+    config = config or CompressionConfig()
+    assert config.time_budget is None, "A batch of images can't be compressed with a time budget"
+    images = np.asarray(images)
+    count, m, n, c = images.shape
+    colorspace = config.colorspace
+    if colorspace == 'auto':
+        colorspace = colorspaces.select(images.reshape(count * m, n, c))
+    image = colorspaces.from_rgb(images.reshape(count * m, n, c), colorspace).reshape(images.shape)
+    # The ratios are chosen for the whole batch, as the images share the codes of each level
+    times, ratios = ratio_schedule(image, config.times, config.ratio)
+    levels = []
+    for level, ratio in enumerate(ratios):
+        ry, rx = _pair(ratio)
+        downsampled = np.copy(image[:,::ry,::rx,:])
+        rescaled = CompressedImage.interpolate(downsampled, image.shape, ratio, config.interpolation)
+        error = image.astype(np.int32) - rescaled
+        codes = None
+        if 'huffman' in config.entropy_coders():
+            mask = EncodedError._error_mask(error.shape[1:], ratio)
+            folded = encoding.zigzag(error)
+            codes = _error_codes([folded[:,:,:,i][:,mask] for i in range(c)], config, level)
+        levels.append((error, codes, ratio, max(times, 1) - level))
+        image = downsampled
+    code = _image_code(image.ravel(), config) if 'huffman' in config.entropy_coders() else None
+    compressed = [EncodedImage(downsampled, config, code) for downsampled in image]
+    for level, (error, codes, ratio, level_times) in reversed(list(enumerate(levels))):
+        compressed = [
+            CompressedImage.from_parts(
+                EncodedError(e, ratio, config, level, codes), d, level_times, config.interpolation,
+                colorspace if level == 0 else None)
+            for e, d in zip(error, compressed)
+        ]
+    return compressed
+
+
+def estimate_size(image, config=None, shape=None):
+    """Estimate the number of bytes each level of the pyramid is encoded to for an RGB image, without encoding it.
+
+    The sizes are given starting from the full size image, followed by
+    the downsampled image at the top of the pyramid. Huffman encoded
+    sizes are exact, as they are added up from the code lengths and the
+    counts of each symbol. zlib sizes are estimated from the entropy of
+    the data. The codes and the rest of the container are not included.
+    The image may be given as a buffer of pixels of `shape`.
+    """
+    config = config or CompressionConfig()
+    _, image = _to_colorspace(as_image(image, shape), config)
+    _, ratios = ratio_schedule(image, config.times, config.ratio)
+    sizes = []
+    for level, ratio in enumerate(ratios):
+        image, error = CompressedImage.predict(image, ratio, config.interpolation)
+        mask = EncodedError._error_mask(error.shape, ratio)
+        folded = encoding.zigzag(error)
+        channels = [folded[:,:,i][mask] for i in range(error.shape[2])]
+        # The number of encoded pixels up to the end of each chunk
+        m = error.shape[0]
+        stops = np.minimum(np.arange(1, ceil(m / config.chunk_rows) + 1) * config.chunk_rows, m)
+        bounds = np.cumsum(mask.sum(axis=1))[stops - 1]
+        estimates = []
+        for entropy in config.entropy_coders():
+            if entropy == 'zlib':
+                estimates.append(sum(encoding.entropy_size(channel) for channel in channels))
+            else:
+                codes = _sampled_error_codes(folded, mask, config, level)
+                estimates.append(sum(encoding.encoded_size(c, code, bounds) for c, code in zip(channels, codes)))
+        sizes.append(min(estimates))
+    data = image.ravel()
+    estimates = []
+    for entropy in config.entropy_coders():
+        if entropy == 'zlib':
+            estimates.append(encoding.entropy_size(data))
+        else:
+            estimates.append(encoding.encoded_size(data, _image_code(data, config)))
+    sizes.append(min(estimates))
+    return sizes
+
+
+def residuals(image, config=None):
+    """Iterate over the data that compressing an RGB image encodes at each level of the pyramid.
+
+    For each level, the channels of the error are given as arrays of
+    the folded errors of the pixels that are encoded. The last item is
+    the downsampled image at the top of the pyramid.
+    """
+    config = config or CompressionConfig()
+    _, image = _to_colorspace(image, config)
+    _, ratios = ratio_schedule(image, config.times, config.ratio)
+    for ratio in ratios:
+        image, error = CompressedImage.predict(image, ratio, config.interpolation)
+        mask = EncodedError._error_mask(error.shape, ratio)
+        folded = encoding.zigzag(error)
+        yield [folded[:,:,i][mask] for i in range(error.shape[2])]
+    yield image
+
+
+def decompress(compressed, level=None, out=None, decoder=None):
+    """Decompress an image compressed by :func:`compress` back to an RGB image.
+
+    The image is written into `out` if it is given, which is a uint8
+    array of the shape of the image, such as a :class:`numpy.memmap`,
+    or a writable buffer of its size. The image is decoded into `out`,
+    and converted to RGB in place. A :class:`Decoder` may be given to
+    reuse its buffers.
+    """
+    if out is None:
+        image = compressed.reconstruct(level) if decoder is None else decoder.reconstruct(compressed, level)
+        return colorspaces.to_rgb(image.astype(np.uint8, copy=False), compressed.colorspace)
+    shape = compressed.level(level or 0).shape
+    out = as_image(out, shape)
+    assert out.shape == shape and out.dtype == np.uint8, "The output must be a uint8 array of the image's shape"
+    (decoder or Decoder()).reconstruct(compressed, level, out)
+    return colorspaces.to_rgb(out, compressed.colorspace, out)
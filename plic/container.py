@@ -0,0 +1,220 @@
+"""The file format for compressed images.
+
+A container starts with a fixed size preamble holding a magic string,
+the format version and the length of the header. The header is a JSON
+document that describes the pyramid of the compressed image, and points
+into the payload that follows it for the encoded bitstreams. The error
+of each channel is split into chunks of rows, and the header holds the
+offset of every chunk so that they can be decoded independently.
+"""
+
+import json
+import struct
+import numpy as np
+from plic import codebook, compression, encoding
+
+MAGIC = b'PLIC'
+VERSION = 1
+_PREAMBLE = struct.Struct('>4sBI')
+
+
+class ContainerError(ValueError):
+    """Raised when the data is not a valid container."""
+
+
+def _dump_codes(codes):
+    """Serialize the codes of each channel, storing the codes shared by multiple channels once."""
+    unique = []
+    for code in codes:
+        if not any(code is u for u in unique):
+            unique.append(code)
+    indices = [next(i for i, u in enumerate(unique) if code is u) for code in codes]
+    return [encoding.dump_code(code) for code in unique], indices
+
+
+def _add_section(payload, data):
+    """Append `data` to the payload, and return its position in the payload."""
+    offset = sum(map(len, payload))
+    payload.append(data)
+    return [offset, len(data)]
+
+
+def _dump_level(level, payload):
+    if isinstance(level, compression.CompressedImage):
+        error = level.error
+        if error.codebook_id is None:
+            codes, channel_codes = _dump_codes(error.codes)
+        else:
+            codes, channel_codes = None, None
+        return {
+            'kind': 'error',
+            'shape': level.shape,
+            'times': level.times,
+            'ratio': level.ratio,
+            'interpolation': level.interpolation,
+            'chunk_rows': error.chunk_rows,
+            'entropy': error.entropy,
+            'codebook': error.codebook_id,
+            'codes': codes,
+            'channel_codes': channel_codes,
+            'sections': [[_add_section(payload, e) for e in chunks] for chunks in error.encoded],
+        }
+    return {
+        'kind': 'image',
+        'shape': level.shape,
+        'dtype': level.dtype.str,
+        'entropy': level.entropy,
+        'codebook': level.codebook_id,
+        'code': None if level.codebook_id else encoding.dump_code(level.code),
+        'sections': [_add_section(payload, level.encoded)],
+    }
+
+
+def _levels(compressed):
+    """Iterate over the levels of the image pyramid, starting from the full size image."""
+    level = compressed
+    while isinstance(level, compression.CompressedImage):
+        yield level
+        level = level.downsampled
+    yield level
+
+
+def dumps(compressed):
+    """Serialize a :class:`plic.compression.CompressedImage` to bytes."""
+    payload = []
+    header = {
+        'shape': compressed.shape,
+        'colorspace': compressed.colorspace,
+        'levels': [_dump_level(level, payload) for level in _levels(compressed)],
+    }
+    encoded_header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    return b''.join([_PREAMBLE.pack(MAGIC, VERSION, len(encoded_header)), encoded_header] + payload)
+
+
+def dump(compressed, file):
+    """Serialize a :class:`plic.compression.CompressedImage` into a binary file object."""
+    file.write(dumps(compressed))
+
+
+def _read_preamble(data):
+    if len(data) < _PREAMBLE.size:
+        raise ContainerError("The data is too short to be a container")
+    magic, version, header_length = _PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ContainerError("The data is not a container")
+    if version != VERSION:
+        raise ContainerError("Unsupported container version {0}".format(version))
+    return header_length
+
+
+def _parse_header(data):
+    """Parse the JSON header of a container."""
+    try:
+        header = json.loads(bytes(data).decode('utf-8'))
+    except ValueError as e:
+        raise ContainerError("The header is not valid JSON: {0}".format(e)) from e
+    if not isinstance(header, dict) or not isinstance(header.get('levels'), list) or 'colorspace' not in header:
+        raise ContainerError("The header does not describe an image")
+    return header
+
+
+def _section(payload, section):
+    offset, length = section
+    if offset < 0 or length < 0 or offset + length > len(payload):
+        raise ContainerError("A section is outside of the payload")
+    return bytes(payload[offset:offset + length])
+
+
+def _load_level(entry, index, payload, downsampled):
+    shared = entry['codebook'] and codebook.get(entry['codebook'])
+    if entry['kind'] == 'image':
+        level = compression.EncodedImage.__new__(compression.EncodedImage)
+        level.shape = tuple(entry['shape'])
+        level.dtype = np.dtype(entry['dtype'])
+        level.entropy = entry['entropy']
+        level.codebook_id = entry['codebook']
+        level.code = shared.image_code if shared else encoding.load_code(entry['code'])
+        level.encoded = _section(payload, entry['sections'][0])
+        return level
+    error = compression.EncodedError.__new__(compression.EncodedError)
+    error.shape = tuple(entry['shape'])
+    # Ratios that differ along each axis are stored as lists
+    error.ratio = tuple(entry['ratio']) if isinstance(entry['ratio'], list) else entry['ratio']
+    error.chunk_rows = entry['chunk_rows']
+    error.entropy = entry['entropy']
+    error.codebook_id = entry['codebook']
+    if shared:
+        error.codes = shared.error_codes(index)
+    else:
+        codes = [encoding.load_code(code) for code in entry['codes']]
+        error.codes = [codes[i] for i in entry['channel_codes']]
+    error.encoded = [[_section(payload, s) for s in chunks] for chunks in entry['sections']]
+    return compression.CompressedImage.from_parts(error, downsampled, entry['times'], entry['interpolation'])
+
+
+def loads(data):
+    """Deserialize a :class:`plic.compression.CompressedImage` from bytes."""
+    header_length = _read_preamble(data)
+    header_end = _PREAMBLE.size + header_length
+    if len(data) < header_end:
+        raise ContainerError("The header is truncated")
+    header = _parse_header(data[_PREAMBLE.size:header_end])
+    payload = memoryview(data)[header_end:]
+    level = None
+    try:
+        for index, entry in reversed(list(enumerate(header['levels']))):
+            level = _load_level(entry, index, payload, level)
+    except ContainerError:
+        raise
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise ContainerError("The header of level {0} is invalid: {1!r}".format(index, e)) from e
+    if level is None:
+        raise ContainerError("The container has no levels")
+    level.colorspace = header['colorspace']
+    return level
+
+
+def load(file):
+    """Deserialize a :class:`plic.compression.CompressedImage` from a binary file object."""
+    return loads(file.read())
+
+
+def read_header(file):
+    """Read only the preamble and the header of the container in a binary file object, and return the header."""
+    header_length = _read_preamble(file.read(_PREAMBLE.size))
+    data = file.read(header_length)
+    if len(data) != header_length:
+        raise ContainerError("The header is truncated")
+    return _parse_header(data)
+
+
+def _section_bytes(sections):
+    """Add up the lengths of the sections, which may be nested in lists."""
+    if sections and isinstance(sections[0], int):
+        return sections[1]
+    return sum(_section_bytes(s) for s in sections)
+
+
+def inspect(path):
+    """Describe the image compressed in the container at `path`, reading only its header.
+
+    The description can be stored as JSON. It has the shape of the
+    image, the number of levels in the pyramid, and the settings and the
+    encoded size of each level, starting from the full size image.
+    """
+    with open(path, 'rb') as f:
+        header = read_header(f)
+    levels = []
+    for entry in header['levels']:
+        level = {k: v for k, v in entry.items() if k not in ('code', 'codes', 'channel_codes', 'sections')}
+        level['bytes'] = _section_bytes(entry['sections'])
+        levels.append(level)
+    return {
+        'shape': levels[0]['shape'],
+        'depth': len(levels),
+        'ratio': levels[0].get('ratio'),
+        'colorspace': header['colorspace'],
+        'version': VERSION,
+        'bytes': sum(level['bytes'] for level in levels),
+        'levels': levels,
+    }
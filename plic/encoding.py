@@ -1,30 +1,261 @@
-from collections import Counter
-import itertools
+import base64
+import heapq
+from itertools import islice
+import zlib
+import bitarray as _bitarray
 from bitarray import bitarray
-import huffman
 import numpy as np
 
+# The entropy coders that the bitstreams may be encoded with
+ENTROPY_CODERS = ('huffman', 'zlib')
 
-def _dict_makebit(dictionary):
-    """`huffman.codebook` function gives regular strings as values. Convert them to bitarrays."""
-    return {k: bitarray(v) for k, v in dictionary.items()}
+# The number of symbols in the errors of 8-bit images after they are folded by `zigzag`, and in 8-bit images
+ERROR_ALPHABET = 512
+IMAGE_ALPHABET = 256
 
+# The codes must fit into the words that they are stored in
+MAX_CODE_LENGTH = 64
 
-def build_dictionary(*arrays):
-    """Build a huffman encoding dictionary that can encode the data in given arrays."""
-    return _dict_makebit(huffman.codebook(Counter(itertools.chain(*arrays)).items()))
 
+def zigzag(array):
+    """Fold signed integers into unsigned ones, so that 0, -1, 1, -2, 2... become 0, 1, 2, 3, 4..."""
+    array = np.asarray(array, dtype=np.int32)
+    return ((array << 1) ^ (array >> 31)).astype(np.uint16)
 
-def encode(array, dictionary):
-    """Encode the data in `array` using the huffman `dictionary`."""
-    b = bitarray(endian='little')
-    b.encode(dictionary, array)
-    # toBytes inserts extra 0's to the end, trim them!
-    return b.tobytes()
 
+def unzigzag(array):
+    """Unfold the unsigned integers created by :func:`zigzag` back to signed integers."""
+    array = np.asarray(array, dtype=np.int32)
+    return (array >> 1) ^ -(array & 1)
 
-def decode(encoded, dictionary):
-    """Decode the `encoded` data into a numpy array using the huffman `dictionary`."""
-    b = bitarray(endian='little')
+
+def _code_lengths(counts):
+    """Find the length of the huffman code of each symbol from the `counts` of the symbols."""
+    lengths = np.zeros(len(counts), dtype=np.uint8)
+    symbols = np.flatnonzero(counts)
+    if len(symbols) == 1:
+        lengths[symbols] = 1
+        return lengths
+    heap = [(count, i, [symbol]) for i, (count, symbol) in enumerate(zip(counts[symbols].tolist(), symbols.tolist()))]
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        first_count, i, first = heapq.heappop(heap)
+        second_count, _, second = heapq.heappop(heap)
+        merged = first + second
+        lengths[merged] += 1
+        heapq.heappush(heap, (first_count + second_count, i, merged))
+    return lengths
+
+
+def _canonical_codes(lengths):
+    """Assign the canonical huffman code to each symbol from the lengths of the codes."""
+    codes = np.zeros(len(lengths), dtype=np.uint64)
+    code = 0
+    previous = 0
+    # Symbols are ordered by the length of their code first, then by their value
+    for symbol in np.lexsort((np.arange(len(lengths)), lengths)):
+        length = int(lengths[symbol])
+        if length == 0:
+            continue
+        code <<= length - previous
+        codes[symbol] = code
+        code += 1
+        previous = length
+    return codes
+
+
+class HuffmanCode:
+    def __init__(self, lengths):
+        """A canonical huffman code, given by the length of the code of each symbol.
+
+        The codes and their lengths are stored in arrays indexed by the
+        symbol. Symbols with a length of 0 have no code.
+        """
+        self.lengths = np.asarray(lengths, dtype=np.uint8)
+        # A code for data with no symbols has no lengths once it is serialized
+        assert not len(self.lengths) or self.lengths.max() <= MAX_CODE_LENGTH, "The huffman codes are too long"
+        self.codes = _canonical_codes(self.lengths)
+        self._dictionary = None
+        self._decoder = None
+
+    @classmethod
+    def from_counts(cls, counts):
+        """Build the huffman code for the `counts` of each symbol."""
+        return cls(_code_lengths(np.asarray(counts)))
+
+    @property
+    def dictionary(self):
+        """The code of each symbol as a bitarray, which is built once for the code."""
+        if self._dictionary is None:
+            self._dictionary = {
+                symbol: bitarray(format(int(self.codes[symbol]), '0{0}b'.format(self.lengths[symbol])))
+                for symbol in np.flatnonzero(self.lengths).tolist()
+            }
+        return self._dictionary
+
+    @property
+    def decoder(self):
+        """A function that decodes a bitarray into an iterable of symbols, with a decode table built once for the code.
+
+        Depending on the version of bitarray, the symbols are given as a
+        list or an iterator.
+        """
+        if self._decoder is None:
+            if not self.dictionary:
+                # A code without symbols only ever decodes the padding of an empty bitstream
+                self._decoder = lambda bits: []
+            elif hasattr(_bitarray, 'decodetree'):
+                tree = _bitarray.decodetree(self.dictionary)
+                self._decoder = lambda bits: bits.decode(tree)
+            elif hasattr(_bitarray, '_mk_tree'):
+                # Older versions of bitarray build the tree in Python on every call to decode. This uses the private
+                # _mk_tree and _decode of bitarray 0.8, the version in requirements.txt, and is skipped if they are gone
+                tree = _bitarray._mk_tree(self.dictionary)
+                self._decoder = lambda bits: bits._decode(tree)
+            else:
+                # decode fails on the padding at the end of the bitstream in bitarray 1.0 to 1.2, while the symbols of
+                # iterdecode are only decoded as far as they are taken
+                dictionary = self.dictionary
+                self._decoder = lambda bits: bits.iterdecode(dictionary)
+        return self._decoder
+
+    def __getstate__(self):
+        # The tables are rebuilt when they are needed, rather than being copied to other processes
+        return {'lengths': self.lengths}
+
+    def __setstate__(self, state):
+        self.__init__(state['lengths'])
+
+    def dumps(self):
+        """Serialize the code to a string of the code lengths."""
+        used = np.flatnonzero(self.lengths)
+        size = used[-1] + 1 if len(used) else 0
+        return base64.b64encode(self.lengths[:size].tobytes()).decode('ascii')
+
+    @classmethod
+    def loads(cls, data):
+        """Deserialize a code serialized by :meth:`dumps`."""
+        return cls(np.frombuffer(base64.b64decode(data), dtype=np.uint8))
+
+
+def count_symbols(*arrays, alphabet=0):
+    """Count how many times each symbol appears in the given arrays of unsigned integers.
+
+    The counts are given in an array indexed by the symbol, that has at
+    least `alphabet` items.
+    """
+    # Older versions of numpy don't accept a minlength of 0
+    return np.bincount(np.concatenate([np.ravel(a) for a in arrays]), minlength=max(alphabet, 1))
+
+
+def sample_rows(count, step, seed=0):
+    """Choose about one in `step` of `count` rows at random, or all of them if `step` is 1.
+
+    The rows are given in order, as an index array or a slice. The same
+    rows are chosen for the same `seed`.
+    """
+    if step <= 1:
+        return slice(None)
+    rows = np.random.RandomState(seed).randint(0, count, max(1, count // step))
+    return np.unique(rows)
+
+
+def build_code(*arrays, alphabet=0, step=1, escape=False):
+    """Build a huffman code that can encode the data in given arrays.
+
+    If `step` is above 1, the code is built from about one in `step`
+    of the rows of each array, chosen by :func:`sample_rows`. When
+    sampling, or with `escape`, every symbol of the `alphabet` is given
+    a code, so that symbols that are missing from the data the code is
+    built from can still be encoded. The symbols that were not seen get
+    the longest codes.
+    """
+    if step > 1:
+        arrays = [a[sample_rows(len(a), step)] for a in arrays]
+    counts = count_symbols(*arrays, alphabet=alphabet)
+    if escape or step > 1:
+        assert alphabet, "The alphabet must be given to give every symbol a code"
+        counts[:alphabet] += 1
+    return HuffmanCode.from_counts(counts)
+
+
+def dump_code(code):
+    """Serialize a huffman code, which may be None, to a form that can be stored as JSON."""
+    return None if code is None else code.dumps()
+
+
+def load_code(code):
+    """Deserialize a huffman code serialized by :func:`dump_code`."""
+    return None if code is None else HuffmanCode.loads(code)
+
+
+def encode(array, code):
+    """Encode the data in `array` using the huffman `code`.
+
+    The codes of all symbols are looked up at once, and packed into a
+    stream of 64-bit words at the bit offsets given by the cumulative
+    sum of their lengths. A code that does not fit into the rest of its
+    word continues at the start of the next word. The end of the
+    bitstream is padded with 0's to a whole byte.
+    """
+    symbols = np.ravel(array)
+    lengths = code.lengths[symbols]
+    ends = np.cumsum(lengths, dtype=np.int64)
+    total = int(ends[-1]) if len(ends) else 0
+    starts = ends - lengths
+    words = starts >> 6
+    offsets = (starts & 63).astype(np.uint64)
+    # The codes aligned to the most significant bit, split into the part in their word and the part in the next one
+    aligned = code.codes[symbols] << (64 - lengths).astype(np.uint64)
+    high = aligned >> offsets
+    low = aligned << ((64 - offsets) & np.uint64(63))
+    low[offsets == 0] = 0
+    stream = np.zeros((total + 63) // 64 + 1, dtype=np.uint64)
+    if total:
+        # The codes in a word don't overlap, so adding them up is the same as or'ing them
+        first = np.flatnonzero(np.concatenate([[True], words[1:] != words[:-1]]))
+        stream[words[first]] += np.add.reduceat(high, first)
+        stream[words[first] + 1] += np.add.reduceat(low, first)
+    return stream.astype('>u8').tobytes()[:(total + 7) // 8]
+
+
+def encoded_size(array, code, bounds=None):
+    """Find the number of bytes `array` is encoded to with the huffman `code`, without encoding it.
+
+    If the array is encoded in chunks that end at the indices in
+    `bounds`, each chunk is padded to whole bytes separately.
+    """
+    bits = np.concatenate([[0], np.cumsum(code.lengths[np.ravel(array)], dtype=np.int64)])
+    if bounds is None:
+        bounds = [len(bits) - 1]
+    chunk_bits = np.diff(np.concatenate([[0], bits[bounds]]))
+    return int(((chunk_bits + 7) // 8).sum())
+
+
+def entropy_size(array):
+    """Estimate the number of bytes `array` can be encoded to, from the entropy of its symbols."""
+    counts = count_symbols(array)
+    counts = counts[counts > 0]
+    return int(np.ceil(-(counts * np.log2(counts / counts.sum())).sum() / 8))
+
+
+def decode(encoded, code, count=None):
+    """Decode the `encoded` data into a numpy array using the huffman `code`.
+
+    The padding at the end of `encoded` may decode into extra symbols, give
+    the `count` of the encoded symbols to trim them.
+    """
+    b = bitarray(endian='big')
     b.frombytes(encoded)
-    return np.array(b.decode(dictionary))
+    symbols = islice(code.decoder(b), count)
+    return np.fromiter(symbols, dtype=np.min_scalar_type(len(code.lengths) - 1), count=-1 if count is None else count)
+
+
+def deflate(array, level=9):
+    """Encode the data in `array` with zlib, keeping the type of `array`."""
+    return zlib.compress(np.ascontiguousarray(array).tobytes(), level)
+
+
+def inflate(encoded, dtype, count=None):
+    """Decode zlib `encoded` data into a numpy array of type `dtype`."""
+    return np.frombuffer(zlib.decompress(encoded), dtype=dtype)[:count]
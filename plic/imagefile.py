@@ -0,0 +1,132 @@
+"""Reading and writing images in uncompressed formats, without going through PIL.
+
+The formats are NumPy's ``.npy``, binary PPM (``.ppm``) and ``.raw``
+files of 8-bit pixels with no header, which need to be told the shape
+of the image. Images in files are memory mapped rather than read, when
+the file allows it. Files in any other format are read and written with
+:mod:`scipy.misc`.
+"""
+
+import os
+
+import numpy as np
+from scipy import misc
+
+# The formats, by the extension of the file name
+FORMATS = {
+    '.npy': 'npy',
+    '.ppm': 'ppm',
+    '.raw': 'raw',
+}
+
+
+def file_format(name):
+    """Find the format of the file called `name`, or None if it isn't one of :data:`FORMATS`."""
+    return FORMATS.get(os.path.splitext(name)[1].lower())
+
+
+def parse_shape(shape):
+    """Parse a shape given as ``HEIGHTxWIDTH`` or ``HEIGHTxWIDTHxCHANNELS``, with 3 channels by default."""
+    shape = tuple(int(n) for n in shape.lower().split('x'))
+    if len(shape) == 2:
+        shape += (3,)
+    if len(shape) != 3 or min(shape) <= 0:
+        raise ValueError("Invalid shape: {0}".format(shape))
+    return shape
+
+
+def _ppm_header(file):
+    """Read the header of a binary PPM file, and return the shape of the image."""
+    fields = []
+    token = b''
+    while len(fields) < 4:
+        c = file.read(1)
+        if c == b'#':
+            file.readline()
+        elif c.isspace() or not c:
+            if token:
+                fields.append(token)
+                token = b''
+            if not c:
+                break
+        else:
+            token += c
+    if len(fields) < 4 or fields[0] != b'P6' or fields[3] != b'255':
+        raise ValueError("Only binary PPM files with 8-bit pixels are supported")
+    width, height = int(fields[1]), int(fields[2])
+    return height, width, 3
+
+
+def _ppm_bytes(shape):
+    m, n, c = shape
+    assert c == 3, "PPM files have 3 channels"
+    return 'P6\n{0} {1}\n255\n'.format(n, m).encode('ascii')
+
+
+def _view(file, offset, shape):
+    """Map the pixels of `shape` at `offset` in `file`, or read them if the file can't be mapped."""
+    try:
+        return np.memmap(file, dtype=np.uint8, mode='r', offset=offset, shape=shape)
+    except (OSError, ValueError, AttributeError):
+        file.seek(offset)
+        return np.frombuffer(file.read(), dtype=np.uint8, count=int(np.prod(shape))).reshape(shape)
+
+
+def read(file, shape=None):
+    """Read the image in `file`, which is a path or a binary file object.
+
+    ``.raw`` files need the `shape` of the image. The image is memory
+    mapped if it is in one of :data:`FORMATS`, and `file` is a file on
+    disk.
+    """
+    name = file if isinstance(file, str) else getattr(file, 'name', '')
+    kind = file_format(name)
+    if kind is None:
+        return misc.imread(file)
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            return read(f, shape)
+    if kind == 'npy':
+        try:
+            return np.load(name, mmap_mode='r')
+        except (OSError, ValueError):
+            return np.load(file)
+    if kind == 'ppm':
+        shape = _ppm_header(file)
+    elif shape is None:
+        raise ValueError("The shape of raw images must be given")
+    return _view(file, file.tell(), shape)
+
+
+def write(file, image):
+    """Write `image` into `file`, which is a path or a binary file object, in the format of its name."""
+    name = file if isinstance(file, str) else getattr(file, 'name', '')
+    kind = file_format(name)
+    if kind is None:
+        misc.imsave(file, image)
+    elif isinstance(file, str):
+        with open(file, 'wb') as f:
+            write(f, image)
+    elif kind == 'npy':
+        np.save(file, image)
+    else:
+        if kind == 'ppm':
+            file.write(_ppm_bytes(image.shape))
+        file.write(np.ascontiguousarray(image, dtype=np.uint8).data)
+
+
+def create(path, shape):
+    """Create a file at `path` for an image of `shape`, and return a writable memory map of its pixels.
+
+    The file is in the format of its name, which must be one of :data:`FORMATS`.
+    """
+    kind = file_format(path)
+    if kind == 'npy':
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+    if kind is None:
+        raise ValueError("Can't map images in {0}".format(path))
+    header = _ppm_bytes(shape) if kind == 'ppm' else b''
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + int(np.prod(shape)))
+    return np.memmap(path, dtype=np.uint8, mode='r+', offset=len(header), shape=shape)
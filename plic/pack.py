@@ -0,0 +1,144 @@
+"""Archives of many compressed images.
+
+A pack is a header, followed by the containers of the images one after
+another, the keys of the images, and an index sorted by key. The index
+has a fixed size record for each image, so that an image can be found
+by a binary search on the memory mapped file without reading the rest
+of the pack. A footer at the end of the file points to the index.
+"""
+
+import mmap
+import os
+import struct
+from plic import container
+
+MAGIC = b'PLICPACK'
+VERSION = 1
+_HEADER = struct.Struct('>8sB')
+# Offset and length of the key, then offset and length of the container
+_RECORD = struct.Struct('>QIQQ')
+# Offset of the index, and the number of images
+_FOOTER = struct.Struct('>QQ8s')
+
+
+class PackError(ValueError):
+    """Raised when a file is not a valid pack."""
+
+
+def _key(key):
+    return key.encode('utf-8') if isinstance(key, str) else bytes(key)
+
+
+class PackWriter:
+    def __init__(self, file):
+        """Write a pack into `file`, which is a path or a binary file object.
+
+        The images are written as they are added, only their keys and
+        positions are kept in memory until the index is written by `close`.
+        """
+        self._owned = isinstance(file, str)
+        self._file = open(file, 'wb') if self._owned else file
+        self._file.write(_HEADER.pack(MAGIC, VERSION))
+        self._offset = _HEADER.size
+        self._entries = {}
+
+    def add(self, key, compressed):
+        """Add a compressed image, or the bytes of its container, to the pack under `key`."""
+        key = _key(key)
+        if key in self._entries:
+            raise KeyError("The pack already has an image named {0!r}".format(key))
+        data = compressed if isinstance(compressed, (bytes, bytearray, memoryview)) else container.dumps(compressed)
+        self._file.write(data)
+        self._entries[key] = (self._offset, len(data))
+        self._offset += len(data)
+
+    def close(self):
+        """Write the index of the pack, and close it."""
+        keys = sorted(self._entries)
+        key_offsets = []
+        for key in keys:
+            key_offsets.append(self._offset)
+            self._file.write(key)
+            self._offset += len(key)
+        index_offset = self._offset
+        for key, key_offset in zip(keys, key_offsets):
+            self._file.write(_RECORD.pack(key_offset, len(key), *self._entries[key]))
+        self._file.write(_FOOTER.pack(index_offset, len(keys), MAGIC))
+        if self._owned:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PackReader:
+    def __init__(self, path):
+        """Read the pack in the file at `path`."""
+        with open(path, 'rb') as f:
+            # An empty file can't be mapped
+            if os.fstat(f.fileno()).st_size < _HEADER.size + _FOOTER.size:
+                raise PackError("{0} is not a pack".format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if _HEADER.unpack_from(self._map) != (MAGIC, VERSION):
+            self._map.close()
+            raise PackError("{0} is not a pack".format(path))
+        self._index_offset, self._count, magic = _FOOTER.unpack_from(self._map, self._map.size() - _FOOTER.size)
+        if magic != MAGIC:
+            self._map.close()
+            raise PackError("{0} is truncated".format(path))
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, i):
+        return _RECORD.unpack_from(self._map, self._index_offset + i * _RECORD.size)
+
+    def _key(self, i):
+        key_offset, key_length, _, _ = self._record(i)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _find(self, key):
+        """Find the index of `key` with a binary search."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._count or self._key(low) != key:
+            raise KeyError(key)
+        return low
+
+    def __contains__(self, key):
+        try:
+            self._find(_key(key))
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        """Iterate over the keys of the images, in sorted order."""
+        for i in range(self._count):
+            yield self._key(i).decode('utf-8')
+
+    def read(self, key):
+        """Get the bytes of the container of the image under `key`."""
+        _, _, offset, length = self._record(self._find(_key(key)))
+        return self._map[offset:offset + length]
+
+    def __getitem__(self, key):
+        """Get the :class:`plic.compression.CompressedImage` under `key`."""
+        return container.loads(self.read(key))
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
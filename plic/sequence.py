@@ -0,0 +1,272 @@
+"""Compression of sequences of frames that change little from one to the next.
+
+Each level of the pyramid of a frame is predicted by interpolating the
+level above it, as for a single image. When the previous frame had the
+same shape, the error of that prediction may instead be encoded as the
+difference from the error of the same level in the previous frame, and
+the top of the pyramid as the difference from the previous top. The
+choice is made for each level, and the decoder keeps the pyramid of the
+previous frame only.
+
+The frames are encoded with a shared codebook, which is kept for as
+long as it encodes the frames nearly as well as a new one would.
+
+A sequence file is a header, followed by records that each start with
+their kind and length. A codebook record holds a serialized
+:class:`plic.codebook.Codebook`, which the frames after it are encoded
+with. A frame record holds whether each level is predicted from the
+previous frame, followed by the container of the frame.
+"""
+
+import struct
+
+import numpy as np
+from plic import codebook, colorspace as colorspaces, compression, container, encoding
+
+MAGIC = b'PLICSEQ'
+VERSION = 1
+_HEADER = struct.Struct('>7sB')
+# The kind and the length of a record
+_RECORD = struct.Struct('>cI')
+# The number of levels of a frame
+_FRAME = struct.Struct('>H')
+_CODEBOOK = b'B'
+_FRAME_KIND = b'F'
+
+
+class SequenceError(ValueError):
+    """Raised when a file is not a valid sequence."""
+
+
+def _wrap(error):
+    """Wrap errors to -128...127. The decoded pixels wrap around the same way, so no information is lost."""
+    return ((error + 128) & 255) - 128
+
+
+def _counts(residual, mask):
+    """Count the folded errors of each channel of `residual` in the pixels selected by `mask`."""
+    folded = encoding.zigzag(residual)
+    return [encoding.count_symbols(folded[:,:,i][mask], alphabet=encoding.ERROR_ALPHABET) for i in range(3)]
+
+
+def _entropy(counts):
+    """The number of bits the symbols with `counts` can be encoded to at best."""
+    counts = np.concatenate(counts) if isinstance(counts, list) else counts
+    counts = counts[counts > 0]
+    return -(counts * np.log2(counts / counts.sum())).sum()
+
+
+def _levels(image, config, ratios):
+    """Find the error of each level of the pyramid of `image` with `ratios`, and the image at the top of it."""
+    errors = []
+    for ratio in ratios:
+        image, error = compression.CompressedImage.predict(image, ratio, config.interpolation)
+        errors.append(error)
+    return errors, image
+
+
+class SequenceWriter:
+    def __init__(self, file, config=None, threshold=0.01):
+        """Write a sequence of RGB frames into `file`, which is a path or a binary file object.
+
+        The frames are compressed with `config`. A new codebook is
+        written when the current one would make a frame more than
+        `threshold` larger than a codebook trained on the frame itself.
+        """
+        self.config = config or compression.CompressionConfig()
+        self.threshold = threshold
+        self._owned = isinstance(file, str)
+        self._file = open(file, 'wb') if self._owned else file
+        self._file.write(_HEADER.pack(MAGIC, VERSION))
+        self._colorspace = None
+        self._codebook = None
+        # The shape of the frames, and the depth and ratios of their pyramids
+        self._schedule = None
+        # The errors of each level and the top of the pyramid of the previous frame
+        self._previous = None
+
+    def _record(self, kind, *parts):
+        self._file.write(_RECORD.pack(kind, sum(len(p) for p in parts)))
+        for part in parts:
+            self._file.write(part)
+
+    def _train(self, level_counts, top_counts):
+        """Train a codebook from the counts of the folded errors of each level, and of the top of a frame.
+
+        Every symbol is given a code, so that the following frames can
+        be encoded with the codebook.
+        """
+        def build(counts):
+            return encoding.HuffmanCode.from_counts(counts + 1)
+
+        if self.config.codebook == 'channel':
+            level_codes = [[build(c) for c in counts] for counts in level_counts]
+        else:
+            level_codes = [[build(sum(counts))] * len(counts) for counts in level_counts]
+        return codebook.Codebook(level_codes, build(top_counts))
+
+    @staticmethod
+    def _encoded_bits(trained, level_counts, top_counts):
+        """Find the number of bits the symbols with the given counts are encoded to with a codebook."""
+        bits = np.dot(top_counts, trained.image_code.lengths[:len(top_counts)])
+        for level, counts in enumerate(level_counts):
+            bits += sum(np.dot(c, code.lengths[:len(c)]) for c, code in zip(counts, trained.error_codes(level)))
+        return bits
+
+    def _update_codebook(self, level_counts, top_counts):
+        """Write a new codebook if the current one encodes the frame worse than one trained on it would."""
+        trained = self._train(level_counts, top_counts)
+        if self._codebook is not None and len(self._codebook.level_codes) >= len(level_counts):
+            current = self._encoded_bits(self._codebook, level_counts, top_counts)
+            new = self._encoded_bits(trained, level_counts, top_counts) + 8 * len(trained.dumps())
+            if current <= new * (1 + self.threshold):
+                return
+        # The frames refer to the codebook by its ID, so it doesn't need to be registered to be written
+        self._codebook = trained
+        self._record(_CODEBOOK, trained.dumps())
+
+    def write(self, frame):
+        """Compress an RGB frame, and write it into the sequence."""
+        config = self.config
+        if self._colorspace is None:
+            # The frames are kept in the same color space, so that they can be predicted from each other
+            self._colorspace = colorspaces.select(frame) if config.colorspace == 'auto' else config.colorspace
+        image = colorspaces.from_rgb(frame, self._colorspace)
+        if self._schedule is None or self._schedule[0] != image.shape:
+            # The ratios are kept while the shape is, so that the levels can be predicted from the previous frame
+            self._schedule = (image.shape,) + compression.ratio_schedule(image, config.times, config.ratio)
+            # Frames of another size have levels of other shapes, so they start over without the previous frame
+            self._previous = None
+        _, times, ratios = self._schedule
+        times = max(times, 1)
+        errors, top = _levels(image, config, ratios)
+        previous = self._previous
+        if previous is not None and previous[1].shape != top.shape:
+            previous = None
+
+        # Predict each level from the previous frame if that leaves less to encode
+        residuals, level_counts, temporal = [], [], []
+        for level, error in enumerate(errors):
+            mask = compression.EncodedError._error_mask(error.shape, ratios[level])
+            candidates = [(error, _counts(error, mask))]
+            if previous is not None:
+                difference = _wrap(error - previous[0][level])
+                candidates.append((difference, _counts(difference, mask)))
+            best = min(range(len(candidates)), key=lambda i: _entropy(candidates[i][1]))
+            residuals.append(candidates[best][0])
+            level_counts.append(candidates[best][1])
+            temporal.append(best == 1)
+        candidates = [(top, encoding.count_symbols(top, alphabet=encoding.IMAGE_ALPHABET))]
+        if previous is not None:
+            difference = top - previous[1]
+            candidates.append((difference, encoding.count_symbols(difference, alphabet=encoding.IMAGE_ALPHABET)))
+        best = min(range(len(candidates)), key=lambda i: _entropy(candidates[i][1]))
+        top_residual, top_counts = candidates[best]
+        temporal.append(best == 1)
+
+        if 'huffman' in config.entropy_coders():
+            self._update_codebook(level_counts, top_counts)
+            config = config.replace(codebook='shared', shared_codebook=self._codebook)
+
+        compressed = compression.EncodedImage(top_residual, config)
+        for level in reversed(range(len(residuals))):
+            error = compression.EncodedError(residuals[level], ratios[level], config, level)
+            compressed = compression.CompressedImage.from_parts(
+                error, compressed, times - level, config.interpolation, self._colorspace if level == 0 else None)
+        self._record(_FRAME_KIND, _FRAME.pack(len(temporal)), bytes(temporal), container.dumps(compressed))
+        self._previous = (errors, top)
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SequenceReader:
+    def __init__(self, file):
+        """Read a sequence from `file`, which is a path or a binary file object.
+
+        Iterating over the reader decodes the frames one after another.
+        """
+        self._owned = isinstance(file, str)
+        self._file = open(file, 'rb') if self._owned else file
+        header = self._file.read(_HEADER.size)
+        if len(header) != _HEADER.size or _HEADER.unpack(header) != (MAGIC, VERSION):
+            raise SequenceError("The file is not a sequence")
+        self._previous = None
+        # The codebook of the following frames, if it was registered by the reader, which keeps only that one
+        self._codebook = None
+
+    def _records(self):
+        while True:
+            header = self._file.read(_RECORD.size)
+            if not header:
+                return
+            if len(header) != _RECORD.size:
+                raise SequenceError("The sequence is truncated")
+            kind, length = _RECORD.unpack(header)
+            data = self._file.read(length)
+            if len(data) != length:
+                raise SequenceError("The sequence is truncated")
+            yield kind, data
+
+    def _reconstruct(self, compressed, temporal):
+        """Decode the pyramid of a frame, adding the previous frame to the levels that were predicted from it."""
+        levels = [compressed.level(i) for i in range(compressed.depth)]
+        image = levels[-1].reconstruct()
+        if temporal[-1]:
+            image = (image + self._previous[1]).astype(np.uint8)
+        top = image
+        errors = [None] * (len(levels) - 1)
+        for level in reversed(range(len(levels) - 1)):
+            part = levels[level]
+            rescaled = part.interpolate(image, part.shape, part.ratio, part.interpolation)
+            error = part.error.reconstruct()
+            if temporal[level]:
+                error += self._previous[0][level]
+            image = (rescaled + error).astype(image.dtype)
+            errors[level] = image.astype(np.int32) - rescaled
+        self._previous = (errors, top)
+        return image
+
+    def _set_codebook(self, loaded):
+        """Register the codebook of the following frames, and unregister the one it replaces.
+
+        Codebooks that were registered before the sequence was read are
+        left registered.
+        """
+        if self._codebook is not None:
+            codebook.unregister(self._codebook)
+        self._codebook = None
+        if loaded is not None and not codebook.is_registered(loaded.id):
+            self._codebook = codebook.register(loaded)
+
+    def __iter__(self):
+        """Decode the RGB frames of the sequence."""
+        for kind, data in self._records():
+            if kind == _CODEBOOK:
+                self._set_codebook(codebook.Codebook.loads(data))
+            elif kind == _FRAME_KIND:
+                count, = _FRAME.unpack_from(data)
+                temporal = data[_FRAME.size:_FRAME.size + count]
+                compressed = container.loads(memoryview(data)[_FRAME.size + count:])
+                image = self._reconstruct(compressed, temporal)
+                yield colorspaces.to_rgb(image, compressed.colorspace)
+            else:
+                raise SequenceError("Unknown record {0!r}".format(kind))
+
+    def close(self):
+        self._set_codebook(None)
+        if self._owned:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,164 @@
+"""HTTP server for decoded images.
+
+The server serves the ``.plic`` files in a directory. A request for
+``/<name>.plic`` responds with the decoded image, and takes the query
+parameters:
+
+``level``
+    The level of the image pyramid to decode, 0 being the full size image.
+``region``
+    The ``x,y,width,height`` of the part of the image to respond with,
+    in the pixel coordinates of the requested level.
+``format``
+    ``png`` for a PNG image, or ``npy`` for the raw array in NumPy's
+    ``.npy`` format.
+
+Decoded levels are kept in a cache, and a request for a finer level
+continues from the closest coarser level in the cache.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import logging
+import os
+from socketserver import ThreadingMixIn
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+import zlib
+
+import numpy as np
+from scipy import misc
+from plic import cache, codebook, colorspace, compression, container
+
+_LOG = logging.getLogger(__name__)
+
+_CONTENT_TYPES = {
+    'png': 'image/png',
+    'npy': 'application/octet-stream',
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Decoder:
+    def __init__(self, directory, cache_bytes):
+        """Decode the images in `directory`, caching up to `cache_bytes` bytes of decoded levels."""
+        self.directory = os.path.realpath(directory)
+        self.cache = cache.LRUCache(cache_bytes)
+        self._local = threading.local()
+
+    def _decoder(self):
+        """Get the :class:`plic.compression.Decoder` of the current thread."""
+        decoder = getattr(self._local, 'decoder', None)
+        if decoder is None:
+            decoder = self._local.decoder = compression.Decoder()
+        return decoder
+
+    def _path(self, name):
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if os.path.dirname(path) != self.directory or not path.endswith('.plic') or not os.path.isfile(path):
+            raise RequestError(404, "No such image: {0}".format(name))
+        return path
+
+    def _compressed(self, path, mtime):
+        key = (path, mtime)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+            compressed = container.loads(data)
+            self.cache.put(key, compressed, len(data))
+        return compressed
+
+    def _level(self, path, mtime, level):
+        """Decode `level` of the image, reusing the closest coarser level in the cache."""
+        key = (path, mtime, level)
+        image = self.cache.get(key)
+        if image is not None:
+            return image
+        compressed = self._compressed(path, mtime)
+        if level == compressed.depth - 1:
+            image = compressed.reconstruct(level)
+        else:
+            image = self._decoder().expand(compressed.level(level), self._level(path, mtime, level + 1))
+        self.cache.put(key, image)
+        return image
+
+    def decode(self, name, level=0, region=None):
+        """Decode `level` of the image `name` to RGB, cropping it to the ``(x, y, width, height)`` `region`."""
+        path = self._path(name)
+        mtime = os.stat(path).st_mtime_ns
+        compressed = self._compressed(path, mtime)
+        if not 0 <= level < compressed.depth:
+            raise RequestError(400, "The image has levels 0 to {0}".format(compressed.depth - 1))
+        image = self._level(path, mtime, level)
+        if region is not None:
+            x, y, width, height = region
+            image = image[y:y + height, x:x + width, :]
+            if image.size == 0:
+                raise RequestError(400, "The region is outside of the image")
+        return colorspace.to_rgb(image.astype(np.uint8), compressed.colorspace)
+
+
+def _parse_query(query):
+    params = {k: v[-1] for k, v in parse_qs(query).items()}
+    try:
+        level = int(params.get('level', 0))
+        region = params.get('region')
+        if region is not None:
+            region = tuple(int(v) for v in region.split(','))
+            if len(region) != 4 or min(region) < 0:
+                raise ValueError(region)
+    except ValueError:
+        raise RequestError(400, "Invalid level or region")
+    output_format = params.get('format', 'png')
+    if output_format not in _CONTENT_TYPES:
+        raise RequestError(400, "Unknown format: {0}".format(output_format))
+    return level, region, output_format
+
+
+def _serialize(image, output_format):
+    buffer = io.BytesIO()
+    if output_format == 'npy':
+        np.save(buffer, image)
+    else:
+        misc.imsave(buffer, image, format='png')
+    return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            level, region, output_format = _parse_query(url.query)
+            image = self.server.decoder.decode(unquote(url.path.lstrip('/')), level, region)
+        except RequestError as e:
+            self.send_error(e.status, str(e))
+            return
+        except (container.ContainerError, codebook.CodebookNotFound, zlib.error) as e:
+            # The file is there but can't be decoded, or its zlib sections are damaged
+            _LOG.warning("Failed to decode %s: %s", url.path, e)
+            self.send_error(500, str(e))
+            return
+        body = _serialize(image, output_format)
+        self.send_response(200)
+        self.send_header('Content-Type', _CONTENT_TYPES[output_format])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _LOG.info(format, *args)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, decoder):
+        """Serve the images of `decoder` on `address`."""
+        super().__init__(address, _Handler)
+        self.decoder = decoder
@@ -0,0 +1,52 @@
+import asyncio
+import io
+from scipy import misc
+from plic import aio, compression, container
+
+
+from .test_base import TEST_SOURCE
+
+
+def _run(coroutine):
+    """Run `coroutine` in a new event loop, like :func:`asyncio.run` of Python 3.7."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAio:
+
+    def test_aio_roundtrip(self):
+        """Compressing then decompressing images concurrently should give back the same images."""
+        pngs = []
+        for image in TEST_SOURCE:
+            png = io.BytesIO()
+            misc.imsave(png, image, format='png')
+            pngs.append(png.getvalue())
+
+        async def roundtrip(service, png):
+            return await service.decompress(await service.compress(png))
+
+        async def run():
+            async with aio.Service(max_workers=2, max_pending=2) as service:
+                return await asyncio.gather(*[roundtrip(service, png) for png in pngs])
+
+        results = asyncio.get_event_loop().run_until_complete(run())
+        for image, result in zip(TEST_SOURCE, results):
+            assert (result == image).all()
+
+    def test_aio_loops(self):
+        """The shared service should keep working when it is used from one event loop after another."""
+        image = TEST_SOURCE[1][:32, :32]
+        png = io.BytesIO()
+        misc.imsave(png, image, format='png')
+
+        async def run():
+            # More requests than can be pending, so that some of them wait for room
+            return await asyncio.gather(*[aio.compress(png.getvalue()) for _ in range(40)])
+
+        for _ in range(2):
+            for data in _run(run()):
+                assert (compression.decompress(container.loads(data)) == image).all()
@@ -0,0 +1,37 @@
+import io
+
+from pytest import raises
+from plic import bench
+
+
+from .test_base import TEST_SOURCE
+
+
+class TestBench:
+
+    def test_bench_run(self):
+        """Every codec should be run on every image, and the results added up for each codec."""
+        image = TEST_SOURCE[0][:64, :64]
+        results = bench.run([('a', image), ('b', image)], ['plic-1', 'png', 'zlib'])
+        assert [(r['image'], r['codec']) for r in results] == [
+            ('a', 'plic-1'), ('a', 'png'), ('a', 'zlib'), ('b', 'plic-1'), ('b', 'png'), ('b', 'zlib')]
+        assert results[0]['bpp'] == results[0]['bytes'] * 8 / (64 * 64)
+        assert 'predict_seconds' in results[0] and 'predict_seconds' not in results[1]
+        assert all(r['peak_memory_mb'] >= 0 for r in results)
+        totals = bench.aggregate(results)
+        assert [t['codec'] for t in totals] == ['plic-1', 'png', 'zlib']
+        assert totals[0]['bytes'] == 2 * results[0]['bytes']
+        assert totals[0]['bpp'] == results[0]['bpp']
+
+    def test_bench_csv(self):
+        """The results should be written with a column for each field."""
+        results = bench.run([('a', TEST_SOURCE[0][:32, :32])], ['lzma'])
+        file = io.StringIO()
+        bench.write_csv(results, file)
+        header, row = file.getvalue().splitlines()
+        assert header.split(',') == list(bench.FIELDS)
+        assert row.startswith('a,lzma,1024,')
+
+    def test_bench_unknown_codec(self):
+        with raises(ValueError):
+            bench.run([], ['gif'])
@@ -0,0 +1,45 @@
+from plic import cache, compression, container
+
+from .test_base import TEST_SOURCE
+
+
+class TestCache:
+
+    def test_cache_eviction(self):
+        """The least recently used values should be evicted once the cache is full."""
+        lru = cache.LRUCache(10)
+        lru.put('a', 'a', 4)
+        lru.put('b', 'b', 4)
+        lru.get('a')
+        lru.put('c', 'c', 4)
+        assert 'a' in lru and 'c' in lru and 'b' not in lru
+        assert lru.nbytes == 8
+        lru.put('d', 'd', 11)
+        assert 'd' not in lru
+
+    def test_disk_cache(self, tmpdir):
+        """Compressing the same image again should reuse the stored result, and old results should be evicted."""
+        image = TEST_SOURCE[1]
+        disk = cache.DiskCache(str(tmpdir), 10 ** 6)
+        data = disk.compress(image)
+        assert (compression.decompress(container.loads(data)) == image).all()
+        key = cache.compression_key(image, compression.CompressionConfig())
+        assert disk.get(key) == data
+        disk.put(key, b'cached')
+        assert disk.compress(image) == b'cached'
+        assert disk.compress(image, compression.CompressionConfig.preset(0)) != b'cached'
+        disk.put('other', b'x' * (10 ** 6 - 1))
+        assert disk.get(key) is None
+
+    def test_disk_cache_scans(self, tmpdir, monkeypatch):
+        """The cache directory should only be scanned when the cache is full, and then be evicted below the limit."""
+        scans = []
+        scandir = cache.os.scandir
+        monkeypatch.setattr(cache.os, 'scandir', lambda path: scans.append(path) or scandir(path))
+        disk = cache.DiskCache(str(tmpdir), 1000)
+        for i in range(200):
+            disk.put(str(i), b'x' * 10)
+        # Once when the size is not known yet, then each time the cache goes over 1000 bytes
+        assert len(scans) == 1 + 10
+        assert sum(f.size() for f in tmpdir.listdir()) <= 1000
+        assert disk.get('199') is not None and disk.get('0') is None
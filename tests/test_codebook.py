@@ -0,0 +1,21 @@
+from pytest import raises
+from plic import codebook, compression, container
+
+
+from .test_base import TEST_SOURCE
+
+
+class TestCodebook:
+
+    def test_codebook_roundtrip(self, tmpdir, monkeypatch):
+        """Images compressed with a shared codebook should decompress once the codebook is found by its ID."""
+        trained = codebook.train(TEST_SOURCE[:2])
+        path = codebook.save(trained, str(tmpdir))
+        assert codebook.Codebook.loads(open(path, 'rb').read()).id == trained.id
+        config = compression.CompressionConfig(codebook='shared', shared_codebook=trained)
+        data = container.dumps(compression.compress(TEST_SOURCE[3], config))
+        monkeypatch.setattr(codebook, '_LOADED', {})
+        with raises(codebook.CodebookNotFound):
+            container.loads(data)
+        monkeypatch.setenv(codebook.PATH_VARIABLE, str(tmpdir))
+        assert (compression.decompress(container.loads(data)) == TEST_SOURCE[3]).all()
@@ -9,3 +9,9 @@ class TestColorspace:
     def test_colorspace_roundtrip(self, image):
         """Converting from RGB to the RdGdB colorspace, then back to RGB should give the same image."""
         assert (colorspace.rdgdb2rgb(colorspace.rgb2rdgdb(image)) == image).all()
+
+    @mark.parametrize('image', TEST_SOURCE)
+    def test_colorspace_select(self, image):
+        """The selected color space should convert back to the same RGB image."""
+        selected = colorspace.select(image)
+        assert (colorspace.to_rgb(colorspace.from_rgb(image, selected), selected) == image).all()
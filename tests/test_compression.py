@@ -1,8 +1,10 @@
-from pytest import mark
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pytest import mark, raises
 from plic import compression
 
 
-from .test_base import TEST_IMAGES
+from .test_base import TEST_IMAGES, TEST_SOURCE
 
 
 class TestCompression:
@@ -11,3 +13,125 @@ class TestCompression:
     def test_compression_roundtrip(self, image):
         """Compressing then decompressing an image should give back the same image."""
         assert (compression.CompressedImage(image).reconstruct() == image).all()
+
+    @mark.parametrize('image', TEST_IMAGES)
+    def test_compression_levels(self, image):
+        """Decompressing up to a level should give back the image downsampled that many times."""
+        compressed = compression.CompressedImage(image, times=2)
+        assert compressed.depth == 3
+        for level in range(compressed.depth):
+            assert (compressed.reconstruct(level) == image[::2 ** level, ::2 ** level, :]).all()
+
+    @mark.parametrize('image', TEST_IMAGES)
+    def test_progressive_decoder(self, image):
+        """Refining level by level should give each level of the pyramid, ending with the full image."""
+        decoder = compression.ProgressiveDecoder(compression.CompressedImage(image, times=2))
+        assert (decoder.image == image[::4, ::4, :]).all()
+        assert (decoder.refine() == image[::2, ::2, :]).all()
+        assert (decoder.refine() == image).all()
+        assert decoder.done
+
+    @mark.parametrize('image', TEST_IMAGES)
+    def test_compression_parallel(self, image):
+        """Decoding the error chunks in parallel should give back the same image."""
+        compressed = compression.CompressedImage(image)
+        with ThreadPoolExecutor(4) as executor:
+            assert (compressed.reconstruct(executor=executor) == image).all()
+
+    @mark.parametrize('level', range(len(compression.CompressionConfig.PRESETS)))
+    def test_compression_presets(self, level):
+        """Compressing with any preset then decompressing should give back the same RGB image."""
+        config = compression.CompressionConfig.preset(level)
+        assert (compression.decompress(compression.compress(TEST_SOURCE[1], config)) == TEST_SOURCE[1]).all()
+
+    @mark.parametrize('ratio', [2, 3])
+    def test_gap_interpolation(self, ratio):
+        """Compressing with the edge-directed interpolation then decompressing should give back the same image."""
+        image = TEST_IMAGES[0][:301, :403]
+        config = compression.CompressionConfig(times=2, ratio=ratio, interpolation='gap')
+        compressed = compression.CompressedImage(image, config=config)
+        assert (compressed.reconstruct() == image).all()
+
+    def test_time_budget(self):
+        """Compressing with a time budget that is too short should fall back to cheaper settings, and stay lossless."""
+        config = compression.CompressionConfig.preset(9, time_budget=0.001)
+        compressed = compression.compress(TEST_SOURCE[1], config)
+        assert compressed.fallbacks[-1] == 'level 0: budget exceeded'
+        assert compressed.interpolation == 'nearest' and compressed.error.entropy == 'huffman'
+        # The full pyramid is kept, as encoding a larger top of the pyramid is not cheaper
+        assert compressed.depth == compression.compress(TEST_SOURCE[1], compression.CompressionConfig.preset(9)).depth
+        assert (compression.decompress(compressed) == TEST_SOURCE[1]).all()
+        assert not compression.compress(TEST_SOURCE[1]).fallbacks
+
+    @mark.parametrize('settings', [{}, {'interpolation': 'gap', 'ratio': 'auto'}])
+    def test_compress_many(self, settings):
+        """Compressing a batch of images then decompressing each should give back the same images."""
+        images = [image[:300, :400] for image in TEST_SOURCE]
+        config = compression.CompressionConfig(**settings)
+        for image, compressed in zip(images, compression.compress_many(images, config)):
+            assert (compression.decompress(compressed) == image).all()
+        with raises(AssertionError):
+            compression.compress_many(images, compression.CompressionConfig(time_budget=1))
+
+    def test_batch_interpolation(self):
+        """Up-sizing a batch of images at once should give each image up-sized on its own, and ratios for the batch."""
+        images = np.stack([image[:300, :400] for image in TEST_SOURCE])
+        downsampled = images[:, ::2, ::4]
+        batch = compression.gap_interpolate(downsampled, images.shape, (2, 4))
+        for image, resized in zip(downsampled, batch):
+            assert (resized == compression.gap_interpolate(image, images.shape[1:], (2, 4))).all()
+        stretched = np.repeat(images[:, :, :100], 4, axis=2)
+        assert compression.ratio_schedule(stretched, times=1, ratio='auto') == (1, [(2, 4)])
+
+    @mark.parametrize('image', TEST_SOURCE)
+    @mark.parametrize('code_sample', [1, 8])
+    def test_estimate_size(self, image, code_sample):
+        """The estimated size of Huffman encoded levels should be the size of the encoded data."""
+        config = compression.CompressionConfig(codebook='channel', code_sample=code_sample)
+        compressed = compression.compress(image, config)
+        sizes = []
+        level = compressed
+        while isinstance(level, compression.CompressedImage):
+            sizes.append(sum(len(e) for chunks in level.error.encoded for e in chunks))
+            level = level.downsampled
+        sizes.append(len(level.encoded))
+        assert compression.estimate_size(image, config) == sizes
+
+    def test_decoder(self):
+        """Decoding images with the same decoder should give back each image, and each level."""
+        decoder = compression.Decoder()
+        for image in TEST_IMAGES + TEST_IMAGES:
+            compressed = compression.CompressedImage(image, times=2)
+            assert (decoder.reconstruct(compressed) == image).all()
+            assert (decoder.reconstruct(compressed, 1) == image[::2, ::2, :]).all()
+
+    @mark.parametrize('ratio', [(2, 3), [2, 4], [(1, 2), (3, 2)], 'auto'])
+    @mark.parametrize('interpolation', ['bilinear', 'gap'])
+    def test_ratio_schedule(self, ratio, interpolation):
+        """Compressing with different ratios along each axis and for each level should give back the same image."""
+        image = TEST_IMAGES[2]
+        config = compression.CompressionConfig(ratio=ratio, interpolation=interpolation)
+        compressed = compression.CompressedImage(image, config=config)
+        assert (compressed.reconstruct() == image).all()
+        assert (compression.Decoder().reconstruct(compressed) == image).all()
+
+    def test_auto_ratio(self):
+        """The ratios should follow the smoother axis, and levels should not be added to noise."""
+        stretched = np.repeat(TEST_IMAGES[0], 4, axis=1)
+        times, ratios = compression.ratio_schedule(stretched, ratio='auto')
+        assert ratios[0] == (2, 4) and times == len(ratios) > 1
+        noise = np.random.RandomState(0).randint(0, 256, (512, 512, 3)).astype(np.uint8)
+        assert compression.ratio_schedule(noise, ratio='auto') == (1, [2])
+        assert compression.ratio_schedule(TEST_IMAGES[0], times=2, ratio=[(2, 4)]) == (2, [(2, 4), (2, 4)])
+        assert compression.parse_ratio('2,2x4') == [2, (2, 4)]
+
+    @mark.parametrize('colorspace', ['rgb', 'rdgdb'])
+    def test_decompress_into(self, colorspace):
+        """Decompressing into an array should decode into it, and give it back."""
+        image = TEST_SOURCE[1]
+        compressed = compression.compress(image, compression.CompressionConfig(times=2, colorspace=colorspace))
+        out = np.zeros_like(image)
+        assert compression.decompress(compressed, out=out) is out
+        assert (out == image).all()
+        top = np.zeros_like(image[::4, ::4])
+        assert (compression.decompress(compressed, 2, top) == compression.decompress(compressed, 2)).all()
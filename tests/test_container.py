@@ -0,0 +1,60 @@
+from pytest import mark, raises
+from plic import compression, container
+
+
+from .test_base import TEST_IMAGES, TEST_SOURCE
+
+
+class TestContainer:
+
+    @mark.parametrize('image', TEST_IMAGES)
+    def test_container_roundtrip(self, image):
+        """Serializing then deserializing a compressed image should give back the same image."""
+        data = container.dumps(compression.CompressedImage(image))
+        assert (container.loads(data).reconstruct() == image).all()
+
+    def test_container_ratios(self):
+        """Ratios that differ along each axis should be kept by the container."""
+        config = compression.CompressionConfig(ratio=[(2, 4), 2])
+        compressed = container.loads(container.dumps(compression.CompressedImage(TEST_IMAGES[1], config=config)))
+        assert [compressed.level(i).ratio for i in range(compressed.depth - 1)] == [(2, 4), 2]
+        assert (compressed.reconstruct() == TEST_IMAGES[1]).all()
+
+    @mark.parametrize('shape, settings', [((1, 1, 3), {}), ((2, 3, 3), {'times': 3}), ((17, 1, 3), {'ratio': (1, 2)})])
+    def test_container_tiny_image(self, shape, settings):
+        """Images with levels that have no error pixels should be loaded back from their container."""
+        image = TEST_SOURCE[0][:shape[0], :shape[1]]
+        config = compression.CompressionConfig.preset(5, **settings)
+        compressed = container.loads(container.dumps(compression.compress(image, config)))
+        assert (compression.decompress(compressed) == image).all()
+
+    def test_container_bad_magic(self):
+        """Data that doesn't start with the magic string should be rejected."""
+        with raises(container.ContainerError):
+            container.loads(b'\x00' * 64)
+
+    @mark.parametrize('old, new', [(b'{"shape"', b'{"shape\xff'), (b'"chunk_rows"', b'"chunk_rowz"'),
+                                   (b'"sections":[[[0,', b'"sections":[[[9999999,')])
+    def test_container_bad_header(self, old, new):
+        """Containers with a damaged header should be rejected."""
+        data = container.dumps(compression.CompressedImage(TEST_IMAGES[0], times=2))
+        assert old in data
+        # Keep the header length of the preamble right
+        header_length = int.from_bytes(data[5:9], 'big') + len(new) - len(old)
+        damaged = data[:5] + header_length.to_bytes(4, 'big') + data[9:].replace(old, new, 1)
+        with raises(container.ContainerError):
+            container.loads(damaged)
+
+    def test_container_inspect(self, tmpdir):
+        """Inspecting a container should describe the image from the header."""
+        compressed = compression.CompressedImage(TEST_IMAGES[0], times=2)
+        path = tmpdir.join('image.plic')
+        data = container.dumps(compressed)
+        path.write_binary(data)
+        info = container.inspect(str(path))
+        assert info['depth'] == 3
+        assert tuple(info['shape']) == TEST_IMAGES[0].shape
+        assert [level['kind'] for level in info['levels']] == ['error', 'error', 'image']
+        with open(str(path), 'rb') as f:
+            container.read_header(f)
+            assert info['bytes'] == len(data) - f.tell()
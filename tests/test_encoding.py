@@ -0,0 +1,37 @@
+import numpy as np
+from pytest import mark
+from plic import encoding
+
+
+class TestEncoding:
+    def test_zigzag_roundtrip(self):
+        """Folding the errors then unfolding them should give the same errors, within the error alphabet."""
+        error = np.arange(-255, 256)
+        folded = encoding.zigzag(error)
+        assert folded.max() < encoding.ERROR_ALPHABET
+        assert (encoding.unzigzag(folded) == error).all()
+
+    @mark.parametrize('counts', [[5, 0, 3, 1, 1], [0, 7], [1] * 512])
+    def test_huffman_roundtrip(self, counts):
+        """Data encoded with a code, and the code loaded from its serialized form, should decode to the same data."""
+        counts = np.asarray(counts)
+        symbols = np.flatnonzero(counts)
+        data = np.repeat(symbols, counts[symbols]).astype(np.uint16)
+        code = encoding.HuffmanCode.from_counts(counts)
+        loaded = encoding.load_code(encoding.dump_code(code))
+        encoded = encoding.encode(data, code)
+        assert len(encoded) == encoding.encoded_size(data, code)
+        assert (encoding.decode(encoded, loaded, len(data)) == data).all()
+
+    def test_long_codes(self):
+        """Codes that cross the words of the bitstream should decode to the same data."""
+        code = encoding.HuffmanCode(list(range(1, 40)) + [39])
+        data = np.random.RandomState(0).randint(0, 40, 1000).astype(np.uint16)
+        assert (encoding.decode(encoding.encode(data, code), code, len(data)) == data).all()
+
+    def test_sampled_code(self):
+        """A code built from a sample should encode the symbols that were not sampled."""
+        data = np.zeros(10000, dtype=np.uint16)
+        data[::1000] = np.arange(10)
+        code = encoding.build_code(data, alphabet=encoding.ERROR_ALPHABET, step=100)
+        assert (encoding.decode(encoding.encode(data, code), code, len(data)) == data).all()
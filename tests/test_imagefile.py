@@ -0,0 +1,32 @@
+from pytest import mark
+from plic import compression, imagefile
+
+from .test_base import TEST_SOURCE
+
+
+class TestImageFile:
+    @mark.parametrize('name', ['image.npy', 'image.ppm', 'image.raw'])
+    def test_imagefile_roundtrip(self, name, tmpdir):
+        """Writing an image then reading it back should give the same image."""
+        image = TEST_SOURCE[1]
+        path = str(tmpdir.join(name))
+        imagefile.write(path, image)
+        assert (imagefile.read(path, image.shape) == image).all()
+
+    def test_decompress_into_file(self, tmpdir):
+        """Decompressing into a mapped file should write the image into the file."""
+        image = TEST_SOURCE[1]
+        compressed = compression.compress(image)
+        path = str(tmpdir.join('image.ppm'))
+        out = imagefile.create(path, image.shape)
+        compression.decompress(compressed, out=out)
+        out.flush()
+        assert (imagefile.read(path) == image).all()
+
+    def test_compress_buffer(self):
+        """Compressing the pixels of an image given as a buffer should compress the image."""
+        image = TEST_SOURCE[1]
+        compressed = compression.compress(memoryview(image.tobytes()), shape=image.shape)
+        out = bytearray(image.nbytes)
+        compression.decompress(compressed, out=out)
+        assert bytes(out) == image.tobytes()
@@ -0,0 +1,31 @@
+from pytest import mark, raises
+from plic import compression, pack
+
+
+from .test_base import TEST_IMAGES
+
+
+class TestPack:
+
+    def test_pack_roundtrip(self, tmpdir):
+        """Images written to a pack should be found by their keys."""
+        path = str(tmpdir.join('images.plicpack'))
+        with pack.PackWriter(path) as writer:
+            for i, image in reversed(list(enumerate(TEST_IMAGES))):
+                writer.add('image{0}'.format(i), compression.CompressedImage(image))
+        with pack.PackReader(path) as reader:
+            assert len(reader) == len(TEST_IMAGES)
+            assert list(reader.keys()) == ['image{0}'.format(i) for i in range(len(TEST_IMAGES))]
+            for i, image in enumerate(TEST_IMAGES):
+                assert (reader['image{0}'.format(i)].reconstruct() == image).all()
+            assert 'image' not in reader
+            with raises(KeyError):
+                reader['image9']
+
+    @mark.parametrize('data', [b'', b'PLICPACK', b'\x00' * 64])
+    def test_pack_invalid(self, data, tmpdir):
+        """Files that are empty, too short or not packs should be rejected."""
+        path = tmpdir.join('invalid.plicpack')
+        path.write_binary(data)
+        with raises(pack.PackError):
+            pack.PackReader(str(path))
@@ -0,0 +1,73 @@
+import io
+
+from pytest import mark
+from plic import codebook, compression, container, sequence
+
+from .test_base import TEST_SOURCE
+
+
+def _frames():
+    """Frames of a still scene, where a small part of the image changes from frame to frame."""
+    image = TEST_SOURCE[0]
+    frames = []
+    for i in range(4):
+        frame = image.copy()
+        frame[100 + 20 * i:140 + 20 * i, 200:260] = 255 - frame[100 + 20 * i:140 + 20 * i, 200:260]
+        frames.append(frame)
+    # A frame of a different size starts over without the previous frame
+    frames.append(TEST_SOURCE[1])
+    return frames
+
+
+class TestSequence:
+    @mark.parametrize('level', [5, 9])
+    def test_sequence_roundtrip(self, level):
+        """Writing a sequence of frames then reading it should give back the same frames, in fewer bytes."""
+        frames = _frames()
+        config = compression.CompressionConfig.preset(level)
+        buffer = io.BytesIO()
+        with sequence.SequenceWriter(buffer, config) as writer:
+            for frame in frames:
+                writer.write(frame)
+        buffer.seek(0)
+        with sequence.SequenceReader(buffer) as reader:
+            decoded = list(reader)
+        assert len(decoded) == len(frames)
+        for frame, image in zip(frames, decoded):
+            assert (frame == image).all()
+        separate = sum(len(container.dumps(compression.compress(frame, config))) for frame in frames)
+        assert len(buffer.getvalue()) < separate
+
+    def test_sequence_size_change(self):
+        """A frame of another size with the same top of the pyramid should not be predicted from the previous one."""
+        frames = [TEST_SOURCE[0], TEST_SOURCE[0][:511, :511], TEST_SOURCE[0][:511, :511]]
+        for config in (compression.CompressionConfig.preset(5), compression.CompressionConfig(times=3)):
+            buffer = io.BytesIO()
+            with sequence.SequenceWriter(buffer, config) as writer:
+                for frame in frames:
+                    writer.write(frame)
+            buffer.seek(0)
+            with sequence.SequenceReader(buffer) as reader:
+                for frame, image in zip(frames, reader):
+                    assert (frame == image).all()
+
+    def test_sequence_codebooks(self, monkeypatch):
+        """Only the current codebook of a sequence should be kept registered while reading it."""
+        created = []
+        init = codebook.Codebook.__init__
+
+        def record(self, *args, **kwargs):
+            init(self, *args, **kwargs)
+            created.append(self.id)
+        monkeypatch.setattr(codebook.Codebook, '__init__', record)
+        buffer = io.BytesIO()
+        with sequence.SequenceWriter(buffer, compression.CompressionConfig.preset(5), threshold=0) as writer:
+            for frame in TEST_SOURCE:
+                writer.write(frame)
+        written = list(created)
+        assert len(written) > 1 and not any(codebook.is_registered(i) for i in written)
+        buffer.seek(0)
+        with sequence.SequenceReader(buffer) as reader:
+            for _ in reader:
+                assert sum(codebook.is_registered(i) for i in set(created)) == 1
+        assert not any(codebook.is_registered(i) for i in created)
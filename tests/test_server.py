@@ -0,0 +1,44 @@
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from pytest import mark, raises
+from plic import compression, container, server
+
+
+from .test_base import TEST_SOURCE
+
+
+class TestServer:
+
+    @mark.parametrize('image', TEST_SOURCE)
+    def test_server_decode(self, image, tmpdir):
+        """Decoding a level and region should reuse the coarser levels and give back that part of the image."""
+        compressed = compression.compress(image)
+        tmpdir.join('image.plic').write_binary(container.dumps(compressed))
+        decoder = server.Decoder(str(tmpdir), 2 ** 30)
+        top = compressed.depth - 1
+        assert (decoder.decode('image.plic', top) == image[::2 ** top, ::2 ** top, :]).all()
+        assert (decoder.decode('image.plic', 0, (10, 20, 30, 40)) == image[20:60, 10:40, :]).all()
+        with raises(server.RequestError):
+            decoder.decode('../image.plic')
+
+    @mark.parametrize('damage', [
+        lambda data: b'not a container',
+        lambda data: data.replace(b'"shape"', b'"shape\xff', 1),
+    ])
+    def test_server_invalid_file(self, damage, tmpdir):
+        """Requesting a file that is not a valid container should respond with a server error."""
+        data = container.dumps(compression.compress(TEST_SOURCE[1][:64, :64]))
+        tmpdir.join('broken.plic').write_binary(damage(data))
+        httpd = server.Server(('127.0.0.1', 0), server.Decoder(str(tmpdir), 2 ** 20))
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            with raises(HTTPError) as e:
+                urlopen('http://127.0.0.1:{0}/broken.plic'.format(httpd.server_address[1]))
+            assert e.value.code == 500
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()